@@ -0,0 +1,82 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Benchmarks commits of persisted data
+
+Runs a plan of actions that each touch a few keys and commit, against
+persisted data of increasing size. Compares the committed/pending layers of
+PersistedDict to the full copy Data.commit used to make.
+
+Usage: python3 benchmarks/commit.py
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyautomate.data import PersistedDict
+
+ACTIONS = 1000
+KEYS_PER_ACTION = 3
+
+class MemoryStorage(object):
+
+    def __init__(self, data):
+        self._data = data
+
+    def get(self, key):
+        return self._data[key]
+
+    def keys(self):
+        return self._data.keys()
+
+def run_layered(size):
+    persisted = PersistedDict(MemoryStorage(make_data(size)))
+    start = time.perf_counter()
+    for action in range(ACTIONS):
+        for i in range(KEYS_PER_ACTION):
+            persisted['#tracker: %d' % ((action * KEYS_PER_ACTION + i) % size)] = action
+        persisted.commit()
+    return time.perf_counter() - start
+
+def run_copy(size):
+    '''the previous implementation: a full copy per commit'''
+    persisted = make_data(size)
+    committed = {}
+    start = time.perf_counter()
+    for action in range(ACTIONS):
+        for i in range(KEYS_PER_ACTION):
+            persisted['#tracker: %d' % ((action * KEYS_PER_ACTION + i) % size)] = action
+        committed['last_state'] = persisted.copy()
+    return time.perf_counter() - start
+
+def make_data(size):
+    return {'#tracker: %d' % i : 'sha256=%064x' % i for i in range(size)}
+
+def main():
+    print('%d actions, time per action of %d writes and a commit' % (ACTIONS, KEYS_PER_ACTION))
+    print('%10s %12s %12s' % ('keys', 'copy', 'layered'))
+    for size in (10**2, 10**3, 10**4, 10**5):
+        print('%10d %10.2fus %10.2fus' % (size, run_copy(size) / ACTIONS * 1e6,
+                                          run_layered(size) / ACTIONS * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Benchmarks the manifest walk of generate_manifest
+
+Builds a synthetic tree, warms the digest cache and compares the walk against
+the previous os.listdir/os.lstat based recursive walk. Both must produce the
+same manifest. Calls to os functions and DirEntry.stat, each a syscall, are
+counted in a separate pass so counting doesn't affect the timings.
+
+Usage: python3 benchmarks/manifest_walk.py [FILES]
+'''
+
+import os
+import stat
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pyautomate.hashcache
+from pyautomate.hash import hash_file, get_alg
+from pyautomate.manifest import generate_manifest
+
+def legacy_manifest(root, alg_name):
+    '''the walk generate_manifest used to do'''
+    def recurse(subdir):
+        full = os.path.join(root, subdir[1:])
+        if not os.path.isdir(full):
+            raise Exception('Not a directory: "%s"' % full)
+        if subdir != '/':
+            yield "D %s" % subdir
+        items = os.listdir(full)
+        items.sort()
+        dirs = []
+        for item in items:
+            path = os.path.join(root, subdir[1:], item)
+            info = os.lstat(path)
+            m = info.st_mode
+            if stat.S_ISREG(m):
+                d = hash_file(path, alg_name, info)
+                if m & 0o111:
+                    yield "X %s %s %s" % (d, info.st_size, item)
+                else:
+                    yield "F %s %s %s" % (d, info.st_size, item)
+            elif stat.S_ISLNK(m):
+                target = os.readlink(path)
+                d = get_alg(alg_name)(os.fsencode(target)).hexdigest()
+                yield "S %s %s %s" % (d, len(target), item)
+            elif stat.S_ISDIR(m):
+                dirs.append(item)
+        if not subdir.endswith('/'):
+            subdir += '/'
+        for x in dirs:
+            for y in recurse(subdir + x): yield y
+    return recurse('/')
+
+def make_tree(root, file_count):
+    '''creates file_count files, 100 per directory, 10 directories deep at most'''
+    for i in range(file_count):
+        directory = os.path.join(root, *('d%d' % int(x) for x in str(i // 100)))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'f%d' % i)
+        with open(path, 'w') as f:
+            f.write(str(i))
+        if i % 10 == 0:
+            os.chmod(path, 0o755)
+        if i % 100 == 0:
+            os.symlink('f%d' % i, path + '.link')
+
+class _CountedEntry(object):
+
+    def __init__(self, entry, counts):
+        self._entry = entry
+        self._counts = counts
+
+    def stat(self, **kwargs):
+        self._counts['DirEntry.stat'] += 1
+        return self._entry.stat(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+class _CountedScandir(object):
+
+    def __init__(self, iterator, counts):
+        self._iterator = iterator
+        self._counts = counts
+
+    def __enter__(self):
+        self._iterator.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._iterator.__exit__(*args)
+
+    def __iter__(self):
+        return (_CountedEntry(entry, self._counts) for entry in self._iterator)
+
+def count_calls(walk):
+    '''returns Counter of syscall-making calls done by walk'''
+    counts = Counter()
+    originals = {name : getattr(os, name)
+                 for name in ('listdir', 'lstat', 'stat', 'scandir', 'readlink')}
+    def wrap(name, function):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            result = function(*args, **kwargs)
+            if name == 'scandir':
+                result = _CountedScandir(result, counts)
+            return result
+        return wrapper
+    for name, function in originals.items():
+        setattr(os, name, wrap(name, function))
+    try:
+        list(walk())
+    finally:
+        for name, function in originals.items():
+            setattr(os, name, function)
+    return counts
+
+def time_walk(walk, repeat=3):
+    '''returns (lines, best wall time) of walk'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        lines = list(walk())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return lines, best
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        root = os.path.join(directory, 'tree')
+        make_tree(root, file_count)
+
+        pyautomate.hashcache._RACY_NS = 0
+        list(generate_manifest(root, 'sha256'))  # warm the digest cache
+
+        walks = (
+            ('listdir+lstat', lambda: legacy_manifest(root, 'sha256')),
+            ('scandir', lambda: generate_manifest(root, 'sha256')),
+        )
+        manifests = []
+        for name, walk in walks:
+            lines, elapsed = time_walk(walk)
+            manifests.append(lines)
+            counts = count_calls(walk)
+            print('%-14s %7.3fs  %6d calls (%s)' % (
+                name, elapsed, sum(counts.values()),
+                ', '.join('%s: %d' % item for item in sorted(counts.items()))))
+        assert manifests[0] == manifests[1], 'manifests differ'
+        print('%d files, %d identical manifest lines' % (file_count, len(manifests[0])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Benchmarks the priority queue of the shortest path search
+
+Replays the operations of a Dijkstra search on a random graph with
+frozenset vertices, like the DFA states of a search: decrease-key heavy
+inserts interleaved with pops. Compares PriorityQueue to the
+priorityDictionary the search used to use.
+
+Usage: python3 benchmarks/priority_queue.py
+'''
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyautomate.priodict import priorityDictionary
+from pyautomate.priorityqueue import PriorityQueue
+
+DEGREE = 8
+
+def make_graph(size):
+    random.seed(size)
+    vertices = [frozenset(random.sample(range(64), 8)) for i in range(size)]
+    return {vertex : [(random.choice(vertices), random.randint(1, 100)) 
+                      for i in range(DEGREE)]
+            for vertex in vertices}
+
+def run(queue_type, graph):
+    '''Dijkstra the way NFAAsDFA.get_shortest_path does it'''
+    start = time.perf_counter()
+    final_distances = {}
+    distances = {}
+    queue = queue_type()
+    vertex = next(iter(graph))
+    distances[vertex] = queue[vertex] = 0
+    for vertex in queue:
+        final_distances[vertex] = distances.pop(vertex)
+        for neighbour, weight in graph[vertex]:
+            path_distance = final_distances[vertex] + weight
+            if neighbour in final_distances:
+                continue
+            if neighbour not in distances or path_distance < distances[neighbour]:
+                distances[neighbour] = queue[neighbour] = path_distance
+    return time.perf_counter() - start
+
+def main():
+    print('%10s %12s %12s' % ('vertices', 'priodict', 'heapq'))
+    for size in (10**3, 10**4, 10**5):
+        graph = make_graph(size)
+        print('%10d %11.3fs %11.3fs' % (size, run(priorityDictionary, graph), 
+                                        run(PriorityQueue, graph)))
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
-from .hash import hash_
+from .hash import hash_, quick_hash_
 from .trackers import trackers
 from .helpers import files_exist
 
@@ -16,27 +16,83 @@
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
 import os.path
+import pyautomate.hash
 import pyautomate.verbosity
 import sys
-import yaml
+import time
 
 from argparse import ArgumentParser
-from importlib import import_module
+from importlib import import_module, reload
+from functools import partial
 from collections import defaultdict
 
 from .data import Data
+from .durations import durations
+from .storage import storages
+from .hashcache import hash_cache
+from .plancache import plan_cache
+from .treehash import tree_store
 
 class Application(object):
 
     def __init__(self):
         self.version = '0.3'
+        self._raw_states = None  # YAML text of self._states
+        self._states = None
 
     def run(self):
         options = self._parse_args()
         self._init_verbosity(options.verbosity)
-        self._load_files(options.auto_path)
-        dfa = self._make_dfa(options.desired_state)
-        self._execute_path(dfa, options.exact)
+        self._init_hash_workers(options.hash_workers)
+        self._load_files(options.auto_path, options.storage, options.fsync_interval)
+        try:
+            if options.daemon:
+                self._serve()
+            else:
+                dfa = self._make_dfa(options.desired_state)
+                self._execute_path(dfa, options)
+        finally:
+            self._data.close()
+
+    def _serve(self):
+        from pyautomate.daemon import serve
+        from pyautomate.watcher import watcher
+        self._hash_workers = pyautomate.hash.default_workers
+        watcher.start()
+        try:
+            serve(self._handle_call)
+        except OSError as ex:
+            self.parser.error(str(ex))
+        finally:
+            watcher.stop()
+
+    def _handle_call(self, args, cwd):
+        '''runs a call forwarded to the daemon
+
+        args: command line arguments of the call
+        cwd: working directory of the call'''
+        from pyautomate.daemon import NotServed
+        from pyautomate.trackers import trackers
+
+        options = self._parse_args(args)
+        auto_path = os.path.join(cwd, options.auto_path)
+        if os.path.realpath(auto_path) != os.path.realpath(self._auto_path):
+            raise NotServed()
+        if options.daemon:
+            self.parser.error('A daemon is already running in this directory')
+
+        self._init_verbosity(options.verbosity)
+        pyautomate.hash.default_workers = self._hash_workers
+        self._init_hash_workers(options.hash_workers)
+        self._reload_auto_file()
+        trackers.invalidate()  # files may have changed since the last call
+        try:
+            dfa = self._make_dfa(options.desired_state)
+            self._execute_path(dfa, options)
+        finally:
+            # changes that weren't committed, e.g. by a get_initial_state that
+            # raised, end with the call as they would with the process
+            self._data.rollback()
 
     @property
     def persisted_data(self):
@@ -48,63 +104,135 @@ class Application(object):
     def _init_verbosity(self, level):
         pyautomate.verbosity.init(level)
 
-    def _parse_args(self):
+    def _init_hash_workers(self, workers):
+        if workers is not None:
+            pyautomate.hash.default_workers = workers
+
+    def _parse_args(self, args=None):
         self.parser = ArgumentParser(description='Automation tool', prog='auto',
                     epilog='For more information see TODO github link readme')
-        self.parser.add_argument('desired_state', metavar='S', nargs='+', 
+        self.parser.add_argument('desired_state', metavar='S', nargs='*',
                         help='a state to reach')
         self.parser.add_argument('--file', '-f', dest='auto_path', default='auto.py',
                         help='the pyautomate config file (default: ./auto.py)')
         self.parser.add_argument('--exact', '-e', default=False, action='store_true',
                         help='when specified desired state must be matched ' + \
                         'exactly (default: partial match)')
+        self.parser.add_argument('--search',
+                        choices=('astar', 'bidirectional', 'dijkstra', 'makespan'),
+                        help='how to search for the shortest path, astar ' + \
+                        'usually expands far fewer states, bidirectional ' + \
+                        'requires --exact, makespan finds the path that ' + \
+                        'finishes soonest with --jobs, taking weights as ' + \
+                        'durations (default: makespan if --jobs is greater ' + \
+                        'than 1, dijkstra otherwise)')
+        self.parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1,
+                        help='execute up to N independent actions at once, ' + \
+                        'actions are independent when they switch disjoint ' + \
+                        'states (default: 1)')
+        self.parser.add_argument('--measured-weights', default=False,
+                        action='store_true',
+                        help='weigh actions by their average duration in ms ' + \
+                        'in earlier runs, actions that never ran keep their ' + \
+                        'configured weight')
+        self.parser.add_argument('--max-nodes', metavar='N', type=int,
+                        help='give up searching a path after expanding N states')
+        self.parser.add_argument('--max-time', metavar='SECONDS', type=float,
+                        help='give up searching a path after SECONDS seconds')
+        self.parser.add_argument('--stats', default=False, action='store_true',
+                        help='print statistics of the path search to stderr')
         self.parser.add_argument('--verbosity', '-v', metavar='V', default=1, type=int,
                         help='verbosity of output. 0 for no output, 1 for ' + \
                         'listing actions, 2 for listing state switches and ' + \
                         'actions (default: 1)')
+        self.parser.add_argument('--hash-workers', metavar='N', type=int,
+                        help='number of threads hash_ uses to hash the files ' + \
+                        'of a directory (default: $PYAUTOMATE_HASH_WORKERS or 1)')
+        self.parser.add_argument('--storage', choices=sorted(storages),
+                        help='where to store persisted data, sqlite imports ' + \
+                        'an existing .pyautomate (default: sqlite if ' + \
+                        '.pyautomate.sqlite exists, yaml otherwise)')
+        self.parser.add_argument('--fsync-interval', metavar='N', type=int, default=1,
+                        help='flush the journal of persisted data to disk ' + \
+                        'every N actions, 0 to leave it to the OS (default: 1)')
+        self.parser.add_argument('--daemon', default=False, action='store_true',
+                        help='keep the auto file and data loaded and run the ' + \
+                        'auto calls in its directory, until interrupted')
         self.parser.add_argument('--version', action='version', 
                         version='%(prog)s ' + self.version)
-        return self.parser.parse_args()
-
-    def _load_files(self, auto_path):
+        options = self.parser.parse_args(args)
+        if not options.desired_state and not options.daemon:
+            self.parser.error('the following arguments are required: S')
+        if options.jobs < 1:
+            self.parser.error('--jobs must be at least 1')
+        if options.hash_workers is not None and options.hash_workers < 1:
+            self.parser.error('--hash-workers must be at least 1')
+        if options.hash_workers is None and 'PYAUTOMATE_HASH_WORKERS' in os.environ:
+            try:
+                options.hash_workers = int(os.environ['PYAUTOMATE_HASH_WORKERS'])
+            except ValueError:
+                self.parser.error('PYAUTOMATE_HASH_WORKERS must be an integer')
+            if options.hash_workers < 1:
+                self.parser.error('PYAUTOMATE_HASH_WORKERS must be at least 1')
+        if options.max_nodes is not None and options.max_nodes < 0:
+            self.parser.error('--max-nodes must be at least 0')
+        if options.max_time is not None and options.max_time < 0:
+            self.parser.error('--max-time must be at least 0')
+        if options.fsync_interval < 0:
+            self.parser.error('--fsync-interval must be at least 0')
+        if options.search is None:
+            options.search = 'makespan' if options.jobs > 1 else 'dijkstra'
+        if options.search == 'bidirectional' and not options.exact:
+            self.parser.error('--search bidirectional requires --exact')
+        return options
+
+    def _load_files(self, auto_path, storage_name, fsync_interval):
         auto_path = os.path.abspath(auto_path)
         auto_dir, auto_file = os.path.split(auto_path)
         if not os.path.exists(auto_path):
             self.parser.error('Could not find auto file at: %s' % auto_path)
         os.chdir(auto_dir)
 
-        self._data = Data()
+        self._auto_path = auto_path
+        self._data = Data(storage_name, fsync_interval)
         self._config = self._load_auto_file(auto_dir, auto_file)
 
     def _load_auto_file(self, auto_dir, auto_file):
         sys.path.insert(0, auto_dir)  # allow importing
 
         auto_module_name = os.path.splitext(auto_file)[0]
+        modified = _get_modified(auto_file)
         try:
             config = import_module(auto_module_name)
         except ImportError as ex:
             self.parser.error('Failed to import auto file: %s' % ex)
+        self._auto_modified = modified
+
+        return self._init_weights(config)
 
+    def _reload_auto_file(self):
+        '''reloads the auto file if it changed since it was loaded'''
+        modified = _get_modified(self._auto_path)
+        if modified != self._auto_modified:
+            self._config = self._init_weights(reload(self._config))
+            self._auto_modified = modified
+
+    def _init_weights(self, config):
         weights = defaultdict(lambda: 1000)
         if hasattr(config, 'weights'):
             weights.update(config.weights)
         config.weights = weights
-
         return config
 
     def _make_dfa(self, desired_state):
         from pyautomate.automata import (
-            GuardedState, StateDict, NFA, NFAAsDFA, UnknownStatesException
+            load_states, NFA, NFAAsDFA, UnknownStatesException
         )
 
-        raw_states = yaml.load(self._config.states)
-        if not raw_states:
-            raw_states = {}
-
-        states = StateDict()
-        for raw_state in raw_states:
-            state = GuardedState(raw_state)
-            states[state.name] = state
+        if self._config.states != self._raw_states:
+            self._states = load_states(self._config.states)
+            self._raw_states = self._config.states
+        states = self._states
 
         start_state = self._config.get_initial_state()
         self._data.commit()
@@ -123,49 +251,122 @@ class Application(object):
                             ', '.join(ex.states)))
         return NFAAsDFA(nfa)
 
-    def _execute_path(self, dfa, exact):
-        from pyautomate.automata import EndUnreachableException
-        from pyautomate.verbosity import (
-            print1, print1e, print2, print2e, level as verbosity_level
+    def _execute_path(self, dfa, options):
+        from pyautomate.automata import (
+            EndUnreachableException, SearchBudgetExceededException
         )
+        from pyautomate.scheduler import execute, get_dependencies
+        from pyautomate.trackers import trackers
+        from pyautomate.verbosity import print2e, printd
 
-        try:
-            for from_, action, to in dfa.get_shortest_path(exact, self._config.weights):
-
-                print1e(action)
-
-                if verbosity_level == 2:
-
-                    for i, right in enumerate(to):
-
-                        if i==0:
-                            fill = '-'
-                            right = '> ' + right
-                            center = action
-                        else:
-                            fill = ' '
-                            center = ''
-                        center_len = 79 - len(right)
+        print2e('Start state:', ', '.join(dfa.start_state))
+        print2e()
 
-                        print('{0:{1}^{3}}{2}'.format(center, fill, right, center_len))
-
-                    print()
-
-                try:
-                    eval(action, vars(self._config))
-                    self._data.commit()
-                except:
-                    print('Failed to execute action:', action, file=sys.stderr)
-                    raise
+        try:
+            path = self._get_path(dfa, options)
+            steps = [partial(self._execute_action, action, to) 
+                     for from_, action, to in path]
+            if options.jobs > 1:
+                dependencies = get_dependencies([dfa.effects(from_, action)
+                                                 for from_, action, to in path])
+            else:
+                dependencies = None
+            execute(steps, dependencies, options.jobs)
 
         except EndUnreachableException:
             print('Desired state (%s) is unreachable from (%s)' % (
                 ', '.join(dfa.end_state), ', '.join(dfa.start_state)
             ))
             self.parser.exit(1)
+        except SearchBudgetExceededException as ex:
+            print('Gave up searching a path to (%s) after expanding %d states' % (
+                ', '.join(dfa.end_state), ex.stats.nodes_expanded
+            ), file=sys.stderr)
+            self.parser.exit(1)
         finally:
+            printd('tracker getter calls: {0}, avoided: {1}'.format(
+                trackers.getter_calls, trackers.getter_calls_avoided))
             self._data.save()
+            hash_cache.save()
+            tree_store.save()
+            plan_cache.save()
+            durations.save()
+
+    def _execute_action(self, action, to):
+        from pyautomate.trackers import trackers
+        from pyautomate.verbosity import print1e, level as verbosity_level
+
+        print1e(action)
+
+        if verbosity_level == 2:
+
+            for i, right in enumerate(to):
+
+                if i==0:
+                    fill = '-'
+                    right = '> ' + right
+                    center = action
+                else:
+                    fill = ' '
+                    center = ''
+                center_len = 79 - len(right)
+
+                print('{0:{1}^{3}}{2}'.format(center, fill, right, center_len))
+
+            print()
+
+        try:
+            trackers.action_started()
+            try:
+                started = time.perf_counter()
+                eval(action, vars(self._config))
+                durations.record(action, time.perf_counter() - started)
+            finally:
+                trackers.action_finished()
+            self._data.commit()
+        except:
+            self._data.rollback()
+            print('Failed to execute action:', action, file=sys.stderr)
+            raise
+
+    def _get_path(self, dfa, options):
+        '''returns shortest path of dfa, planned in an earlier run if possible'''
+        from pyautomate.automata import EndUnreachableException
 
+        weights = self._config.weights
+        if options.measured_weights:
+            weights = durations.get_weights(weights, dfa.alphabet)
+        key = plan_cache.make_key(self._config.states, dfa.start_state,
+                                  dfa.end_state, options.exact, 
+                                  {symbol : weights[symbol] for symbol in dfa.alphabet},
+                                  options.search, options.jobs)
+        if key in plan_cache:
+            path = plan_cache.get(key)
+            if options.stats:
+                print('plan cache hit', file=sys.stderr)
+        else:
+            try:
+                result = dfa.search(options.exact, weights, options.search,
+                                    options.max_nodes, options.max_time,
+                                    options.jobs)
+                path = result.path
+                stats = result.stats
+            except EndUnreachableException as ex:
+                path = None
+                stats = ex.stats
+            plan_cache.set(key, path)
+            if options.stats:
+                print(stats, file=sys.stderr)
+
+        if path is None:
+            raise EndUnreachableException()
+        return path
+
+
+def _get_modified(path):
+    '''returns what changes when the file at path is modified'''
+    info = os.stat(path)
+    return (info.st_mtime_ns, info.st_size)
 
 application = Application()
 del Application
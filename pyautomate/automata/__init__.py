@@ -15,13 +15,22 @@
 # You should have received a copy of the GNU General Public License
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
-class EndUnreachableException(Exception): pass
+class EndUnreachableException(Exception):
+    def __init__(self, stats=None):
+        Exception.__init__(self)
+        self.stats = stats
+
+class SearchBudgetExceededException(Exception):
+    def __init__(self, stats):
+        Exception.__init__(self)
+        self.stats = stats
 
 class UnknownStatesException(Exception):
     def __init__(self, states):
         Exception.__init__(self)
         self.states = states
 
-from .nfa import NFA, NFAAsDFA
+from .nfa import NFA, NFAAsDFA, SearchResult, SearchStats
 from .guardedstate import GuardedState
 from .statedict import StateDict
+from .compiled import load_states
@@ -0,0 +1,68 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Cache of compiled states
+
+Parsing the states YAML and building its states takes long for large state
+machines. The built states are pickled to .pyautomate.automaton along with a
+digest of the YAML they were built from, and reused while it's unchanged.
+'''
+
+import hashlib
+import os
+import pickle
+import yaml
+
+from .guardedstate import GuardedState
+from .statedict import StateDict
+
+# Version of the pickled representation, increment on changes to the classes
+# of states
+_FORMAT = 1
+
+def load_states(raw_states):
+    '''returns StateDict of states described by the YAML text raw_states'''
+    key = hashlib.sha256(raw_states.encode('UTF-8')).hexdigest()
+    path = os.path.abspath('.pyautomate.automaton')
+    try:
+        with open(path, 'rb') as f:
+            format_, cached_key, states = pickle.load(f)
+        if (format_, cached_key) == (_FORMAT, key):
+            return states
+    except Exception:
+        pass  # missing, corrupt or outdated cache
+
+    states = compile_states(raw_states)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        pickle.dump((_FORMAT, key, states), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+    return states
+
+def compile_states(raw_states):
+    '''returns StateDict of states described by the YAML text raw_states'''
+    raw_states = yaml.load(raw_states)
+    if not raw_states:
+        raw_states = {}
+
+    states = StateDict()
+    for raw_state in raw_states:
+        state = GuardedState(raw_state)
+        states[state.name] = state
+    return states
@@ -27,6 +27,9 @@ class _GuardDict(defaultdict):
     def __missing__(self, key):
         return frozenset()
 
+    def __reduce__(self):
+        return (_GuardDict, (), None, None, iter(self.items()))
+
  
 class GuardedState(State):
 
@@ -40,6 +43,9 @@ class GuardedState(State):
             required_states = StateNames(raw_transition['guard']['state contains'])
             self._guards[raw_transition['action']] = required_states
 
+    def guard(self, symbol):
+        return self._guards[symbol]
+
     def transition(self, symbol, current_states):
         if self._guards[symbol].issubset(current_states):
             return State.transition(self, symbol, current_states)
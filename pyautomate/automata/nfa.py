@@ -15,10 +15,16 @@
 # You should have received a copy of the GNU General Public License
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
-from pyautomate.priodict import priorityDictionary
-from pyautomate.verbosity import printd, print2e, level as verbosity_level
+import heapq
+import time
+from contextlib import contextmanager
 
-from . import UnknownStatesException, EndUnreachableException
+from pyautomate.priorityqueue import PriorityQueue
+from pyautomate import verbosity  # its functions change with each call's -v
+
+from . import (
+    UnknownStatesException, EndUnreachableException, SearchBudgetExceededException
+)
 from .statename import StateNames
 
 class NFA(object):
@@ -41,6 +47,11 @@ class NFA(object):
         return frozenset.union(self.start_states, *[state.state_names 
                                for state in self._states.values()])
 
+    @property
+    def states(self):
+        '''StateDict of the states'''
+        return self._states
+
     def transition(self, state_name, symbol, current_states):
         '''
         returns the state names to which the NFA transitions when given symbol
@@ -53,25 +64,123 @@ class NFAAsDFA(object):
     # Note: nfa state variables are named explicitly (e.g. nfa_state), dfa
     # states aren't (e.g. state)
 
+    # Internally, each NFA state name is assigned a bit and DFA states are
+    # encoded as int masks of their NFA states (named mask variables). For
+    # each symbol a table of transition rules is precomputed, see _encode_rules.
+
     def __init__(self, nfa):
+        started = time.perf_counter()
         self._nfa = nfa
 
+        self._names = sorted(nfa.state_names)
+        self._bits = {name : 1 << i for i, name in enumerate(self._names)}
+        self._rules = self._encode_rules()
+        self._reverse_rules = None  # see _get_predecessors
+
+        # symbols to try per bit, symbols of the anonymous state are always tried
+        states = nfa.states
+        self._anonymous_symbols = states[''].symbols if '' in states else frozenset()
+        self._symbols = {}
+        for name, bit in self._bits.items():
+            if name in states:
+                symbols = states[name].symbols - self._anonymous_symbols
+                if symbols:
+                    self._symbols[bit] = symbols
+
+        self._encode_time = time.perf_counter() - started
+
+    def _encode_rules(self):
+        '''returns {symbol : (reactive mask, [(source mask, guard mask, target mask)])}
+
+        The NFA states of the reactive mask leave when given symbol, all other
+        states stay. The rules give the states that are entered: target if the
+        source state is present (or if source is 0, which stands for the
+        anonymous state) and all guard states are present.'''
+        encoded_rules = {symbol : (0, []) for symbol in self._nfa.alphabet}
+        for nfa_state_name, nfa_state in self._nfa.states.items():
+            if nfa_state_name:
+                if nfa_state_name not in self._bits:
+                    continue  # unreachable
+                source = self._bits[nfa_state_name]
+            else:
+                source = 0
+            for symbol in nfa_state.symbols:
+                reactive, rules = encoded_rules[symbol]
+                encoded_rules[symbol] = (reactive | source, rules)
+                guard = nfa_state.guard(symbol)
+                if any(name not in self._bits for name in guard):
+                    continue  # guard can never be satisfied
+                rules.append((source, self._encode(guard),
+                              self._encode(nfa_state.targets(symbol))))
+        return encoded_rules
+
+    def _encode(self, state):
+        mask = 0
+        for nfa_state in state:
+            mask |= self._bits[nfa_state]
+        return mask
+
+    def _decode(self, mask):
+        return frozenset(self._names[bit.bit_length() - 1]
+                         for bit in self._bits_of(mask))
+
+    def _transition(self, mask, symbol):
+        reactive, rules = self._rules[symbol]
+        new_mask = mask & ~reactive
+        for source, guard, target in rules:
+            if (not source or mask & source) and mask & guard == guard:
+                new_mask |= target
+        return new_mask
+
     def transition(self, state, symbol):
-        new_states = set()
+        return self._decode(self._transition(self._encode(state), symbol))
+
+    def effects(self, state, symbol):
+        '''returns (read, written) NFA state names of transitioning on symbol at
+        state
 
-        for nfa_state in state | frozenset(('',)):  # '' == the nameless state
-            new_states |= self._nfa.transition(nfa_state, symbol, state)
+        read: the states whose presence decides what the transition does,
+        i.e. those reacting to symbol and those its guards require
+        written: the states that leave or are entered'''
+        read, written = self._effects(self._encode(state), symbol)
+        return self._decode(read), self._decode(written)
 
-        return frozenset(new_states)
+    def _effects(self, mask, symbol, neighbour=None):
+        '''returns (read mask, written mask), see effects
+
+        neighbour: the result of transitioning on symbol at mask, if known'''
+        reactive, rules = self._rules[symbol]
+        read = reactive
+        for source, guard, target in rules:
+            read |= guard
+        if neighbour is None:
+            neighbour = self._transition(mask, symbol)
+        return read, (mask & reactive) | (neighbour & ~mask)
+
+    def _get_neighbours(self, mask):
+        symbols = set(self._anonymous_symbols)
+        remaining = mask
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            if bit in self._symbols:
+                symbols |= self._symbols[bit]
+
+        for symbol in sorted(symbols):
+            yield (symbol, self._transition(mask, symbol))
 
     def get_neighbours(self, state):
         '''returns iterable of (symbol, neighbour) of each neighbour of state
         
         Neighbours are all incident states, this includes state itself in case
-        of loops.'''
-        for symbol in self._nfa.alphabet:
-            neighbour = self.transition(state, symbol)
-            yield (symbol, neighbour) 
+        of loops. Symbols to which none of the NFA states react are skipped,
+        those would only loop.'''
+        for symbol, neighbour in self._get_neighbours(self._encode(state)):
+            yield (symbol, self._decode(neighbour))
+
+    @property
+    def alphabet(self):
+        return self._nfa.alphabet
 
     @property
     def start_state(self):
@@ -81,71 +190,580 @@ class NFAAsDFA(object):
     def end_state(self):
         return self._nfa.end_states
 
-    def get_shortest_path(self, exact, weights):
+    def _make_heuristic(self, exact, weights):
+        '''returns an admissible and consistent A* heuristic for reaching end
+
+        The heuristic is h_max of the relaxation in which NFA states are never
+        left: the cost of an NFA state is 0 when present, else the cheapest
+        weight of a transition to it plus the highest cost of its source and
+        guard states. Any path to end pays at least the cost of each desired
+        state, so the heuristic is the highest of those. When exact, any
+        extra NFA state needs at least one action to leave.'''
+        # rules as (weight, preconditions, targets) with preconditions and
+        # targets as lists of bits, watchers: bit -> indices of rules it's a
+        # precondition of
+        rules = []
+        watchers = {}
+        free_rules = []  # rules without preconditions
+        for symbol, (reactive, symbol_rules) in self._rules.items():
+            for source, guard, target in symbol_rules:
+                preconditions = self._bits_of(source | guard)
+                index = len(rules)
+                rules.append((weights[symbol], len(preconditions), self._bits_of(target)))
+                if not preconditions:
+                    free_rules.append(index)
+                for bit in preconditions:
+                    watchers.setdefault(bit, []).append(index)
+
+        precondition_counts = [count for weight, count, targets in rules]
+        free_targets = sorted((rules[index][0], bit) for index in free_rules
+                              for bit in rules[index][2])
+
+        end_mask = self._encode(self.end_state)
+        min_weight = min([weights[symbol] for symbol in self._rules] or [0])
+        infinity = float('inf')
+
+        def heuristic(mask):
+            missing = end_mask & ~mask
+            estimate = 0
+            if missing:
+                # Dijkstra over the NFA states, rules fire once all their
+                # preconditions are reached
+                unreached = list(precondition_counts)
+                queue = list(free_targets)
+                reached = mask
+                cost = 0
+                bits = self._bits_of(mask)
+                while True:
+                    for bit in bits:
+                        for index in watchers.get(bit, ()):
+                            unreached[index] -= 1
+                            if not unreached[index]:
+                                weight, count, targets = rules[index]
+                                for target in targets:
+                                    if not reached & target:
+                                        heapq.heappush(queue, (cost + weight, target))
+                    while True:
+                        if not queue:
+                            return infinity  # a desired state can't be entered
+                        cost, bit = heapq.heappop(queue)
+                        if not reached & bit:
+                            break
+                    reached |= bit
+                    missing &= ~bit
+                    if not missing:
+                        break
+                    bits = (bit,)
+                estimate = cost
+            if exact and mask & ~end_mask:
+                estimate = max(estimate, min_weight)
+            return estimate
+
+        return heuristic
+
+    @staticmethod
+    def _bits_of(mask):
+        '''returns list of the bits set in mask'''
+        bits = []
+        while mask:
+            bit = mask & -mask
+            bits.append(bit)
+            mask ^= bit
+        return bits
+
+    def _get_predecessors(self, mask):
+        '''returns iterable of (symbol, predecessor) of each predecessor of mask,
+        predecessors are states that transition to mask, excluding itself
+
+        Raises _TooManyPredecessors when mask has too many predecessors or too
+        many candidates would have to be tried.'''
+        if self._reverse_rules is None:
+            self._reverse_rules = self._encode_reverse_rules()
+        produced_by, entering, leaving = self._reverse_rules
+
+        symbols = set(leaving)
+        for bit in self._bits_of(mask):
+            symbols |= entering.get(bit.bit_length(), frozenset())
+
+        count = 0
+        for symbol in sorted(symbols):
+            reactive, rules = self._rules[symbol]
+            produced, unguarded = produced_by[symbol]
+            if mask & reactive & ~produced:
+                continue  # a reactive state of mask couldn't have been entered
+
+            # Staying states are in the predecessor, unless a rule entered
+            # them. Reactive states may have been present, unless they'd have
+            # entered states not in mask.
+            stays = mask & ~reactive
+            forced = stays & ~produced
+            optional = (stays & produced) | reactive
+            for source, target in unguarded:
+                if target & ~mask:
+                    optional &= ~source
+            optional = self._bits_of(optional)
+            if len(optional) > _MAX_OPTIONAL_PREDECESSOR_STATES:
+                raise _TooManyPredecessors()
+
+            for i in range(1 << len(optional)):
+                predecessor = forced
+                for j, bit in enumerate(optional):
+                    if i >> j & 1:
+                        predecessor |= bit
+                if predecessor != mask and self._transition(predecessor, symbol) == mask:
+                    count += 1
+                    if count > _MAX_PREDECESSORS:
+                        raise _TooManyPredecessors()
+                    yield (symbol, predecessor)
+
+    def _encode_reverse_rules(self):
+        '''returns (produced_by, entering, leaving)
+
+        produced_by: {symbol : (mask of states its rules enter, 
+                      [(source mask, target mask)] of its unguarded rules)}
+        entering: {bit length : symbols with a rule that enters the bit}
+        leaving: symbols with a reactive state that can leave without entering
+            a state'''
+        produced_by = {}
+        entering = {}
+        leaving = []
+        for symbol, (reactive, rules) in self._rules.items():
+            produced = 0
+            unguarded = []
+            for source, guard, target in rules:
+                produced |= target
+                for bit in self._bits_of(target):
+                    entering.setdefault(bit.bit_length(), set()).add(symbol)
+                if source and not guard:
+                    unguarded.append((source, target))
+                    if target:
+                        reactive &= ~source
+            produced_by[symbol] = produced, unguarded
+            if reactive:
+                leaving.append(symbol)
+        return produced_by, entering, leaving
+
+    def get_shortest_path(self, exact, weights, search='dijkstra'):
         '''returns shortest path from start to end as list of actions
         exact: whether the end state should be matched partially or exactly
         weights: {symbol : weight}
+        search: 'dijkstra', 'astar' or 'bidirectional'. All find a shortest
+        path, A* guides the search to end and tends to expand far fewer
+        states. Bidirectional requires exact, it searches from both start and
+        end and falls back to dijkstra when states have too many predecessors
         '''
-        if verbosity_level == 3:
-            printd('weights:', weights)
-            printd('default weight:', weights[None])
-            del weights[None]
-            printd()
+        return self.search(exact, weights, search).path
 
-        printd('exact:', exact)
-        if exact:
-            reached_destination = lambda: state == self.end_state
-        else:
-            reached_destination = lambda: self.end_state.issubset(state)
+    def search(self, exact, weights, search='dijkstra', max_nodes=None, max_time=None,
+               jobs=1):
+        '''returns SearchResult of the shortest path from start to end
+
+        See get_shortest_path for the other parameters.
+        search: may also be 'makespan', which finds the path that finishes
+        soonest when independent actions run concurrently on jobs workers,
+        taking weights as durations (see effects)
+        max_nodes: maximum number of states to expand, or None
+        max_time: maximum number of seconds to search, or None
+        jobs: number of workers, for makespan
 
-        print2e('Start state:', ', '.join(self.start_state))
-        print2e()
+        Raises SearchBudgetExceededException when a budget is exceeded,
+        EndUnreachableException when end is unreachable.'''
+        if verbosity.level == 3:
+            verbosity.printd('weights:', weights)
+            verbosity.printd('default weight:', weights[None])
+            del weights[None]
+            verbosity.printd()
 
+        verbosity.printd('exact:', exact)
+        verbosity.printd('search:', search)
+        if search not in ('astar', 'dijkstra', 'bidirectional', 'makespan'):
+            raise ValueError('Unknown search: {0}'.format(search))
+        if search == 'bidirectional' and not exact:
+            raise ValueError('Bidirectional search requires an exact end state')
+
+        stats = SearchStats(search)
+        stats.phases.append(('encode', self._encode_time))
         if self.start_state == self.end_state:
-            return ()
+            return SearchResult((), stats)
+
+        budget = _Budget(stats, max_nodes, max_time)
+        start_mask = self._encode(self.start_state)
+        end_mask = self._encode(self.end_state)
+        verbosity.printd('contacting neighbours for path to', self.end_state)
+        path = None
+        if search == 'bidirectional':
+            try:
+                with budget.phase('search'):
+                    path = self._search_bidirectional(start_mask, end_mask, weights, budget)
+            except _TooManyPredecessors:
+                verbosity.printd('too many predecessors, falling back to dijkstra')
+                stats.search = 'dijkstra'
+        if path is None:
+            if search in ('astar', 'makespan'):
+                with budget.phase('heuristic'):
+                    heuristic = self._make_heuristic(exact, weights)
+            else:
+                heuristic = lambda mask: 0
+            with budget.phase('search'):
+                path = self._search(start_mask, end_mask, exact, weights, heuristic, budget)
+                if search == 'makespan' and jobs > 1:
+                    path = self._search_makespan(start_mask, end_mask, exact, weights,
+                                                 heuristic, jobs, path, budget)
+
+        with budget.phase('decode'):
+            path = [(self._decode(from_), symbol, self._decode(to))
+                    for from_, symbol, to in path]
+        return SearchResult(path, stats)
+
+    def _search(self, start_mask, end_mask, exact, weights, heuristic, budget):
+        '''returns shortest path as list of (from mask, symbol, to mask)'''
+        if exact:
+            reached_destination = lambda: mask == end_mask
+        else:
+            reached_destination = lambda: mask & end_mask == end_mask
 
         # Adapted from:
         # David Eppstein, UC Irvine, 4 April 2002
         # http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/117228
+        # With a consistent heuristic, A* is Dijkstra on the estimated total
+        # distances (distance + heuristic), so states are still final when
+        # they are popped.
 
         final_distances = {}  # dictionary of final distances
         predecessors = {}  # dictionary of predecessors
-        estimated_distances = priorityDictionary()  # est.dist. of non-final vert.
-        estimated_distances[self.start_state] = 0
+        distances = {}  # distance of non-final vertices
+        estimates = {}  # heuristic of each vertex
+        estimated_distances = PriorityQueue()  # est. total dist. of non-final vert.
+
+        estimates[start_mask] = heuristic(start_mask)
+        if estimates[start_mask] == float('inf'):
+            raise EndUnreachableException(budget.stats)
+        distances[start_mask] = 0
+        estimated_distances[start_mask] = estimates[start_mask]
 
         end = None
-        printd('contacting neighbours for path to', self.end_state)
-        for state in estimated_distances:
-            printd()
-            printd(state)
-            final_distances[state] = estimated_distances[state]
+        stats = budget.stats
+        debug = verbosity.level == 3
+        for mask in estimated_distances:
+            if debug:
+                verbosity.printd()
+                verbosity.printd(self._decode(mask))
+            final_distances[mask] = distances.pop(mask)
             if reached_destination(): 
-                if exact: end = self.end_state
-                else: end = state
+                end = mask
                 break
 
-            for symbol, neighbour in self.get_neighbours(state):
-                if neighbour == state:
+            budget.expand()
+            for symbol, neighbour in self._get_neighbours(mask):
+                stats.transitions_evaluated += 1
+                if neighbour == mask:
                     continue
-                printd('{0}: {1}'.format(symbol, neighbour))
-                path_distance = final_distances[state] + weights[symbol]
+                if debug:
+                    verbosity.printd('{0}: {1}'.format(symbol, self._decode(neighbour)))
+                path_distance = final_distances[mask] + weights[symbol]
                 if neighbour in final_distances:
                     if path_distance < final_distances[neighbour]:
                         raise ValueError("Dijkstra: found better path to already-final vertex")
-                elif neighbour not in estimated_distances or path_distance < estimated_distances[neighbour]:
-                    estimated_distances[neighbour] = path_distance
-                    predecessors[neighbour] = (state, symbol)
+                    continue
+
+                if neighbour not in estimates:
+                    estimates[neighbour] = heuristic(neighbour)
+                if estimates[neighbour] == float('inf'):
+                    continue  # end is unreachable from neighbour
+                if neighbour not in distances or path_distance < distances[neighbour]:
+                    distances[neighbour] = path_distance
+                    estimated_distances[neighbour] = path_distance + estimates[neighbour]
+                    predecessors[neighbour] = (mask, symbol)
+            stats.queue_peak = max(stats.queue_peak, len(estimated_distances))
 
         path = []
-        if not end:
+        if end is None:
             # this means we found no path to our destination
-            raise EndUnreachableException()
+            raise EndUnreachableException(stats)
 
-        while end != self.start_state:
+        while end != start_mask:
             to = end
             (end, symbol) = predecessors[end]
             from_ = end
             path.append((from_, symbol, to))
 
-        return reversed(path)
+        path.reverse()
+        return path
+
+    def _search_bidirectional(self, start_mask, end_mask, weights, budget):
+        '''returns shortest path as list of (from mask, symbol, to mask)
+
+        Runs Dijkstra forward from start and backward from end, each time
+        expanding the direction with the smallest frontier, until no shorter
+        path through a state reached from both sides can be found. When
+        states have many predecessors, the search is mostly forward.'''
+        forward = _Direction(start_mask, self._get_neighbours)
+        backward = _Direction(end_mask, self._get_predecessors)
+
+        stats = budget.stats
+        debug = verbosity.level == 3
+        shortest = float('inf')  # length of shortest path found so far
+        meeting_mask = None  # the state in which that path's directions meet
+        while forward.queue and backward.queue:
+            if forward.queue.peek()[1] + backward.queue.peek()[1] >= shortest:
+                break
+
+            if len(forward.queue) <= len(backward.queue):
+                direction, other = forward, backward
+            else:
+                direction, other = backward, forward
+
+            mask, distance = direction.queue.pop()
+            direction.final.add(mask)
+            if debug:
+                verbosity.printd()
+                verbosity.printd(self._decode(mask))
+            budget.expand()
+            for symbol, neighbour in direction.get_neighbours(mask):
+                stats.transitions_evaluated += 1
+                if neighbour == mask or neighbour in direction.final:
+                    continue
+                path_distance = distance + weights[symbol]
+                if path_distance < direction.distances.get(neighbour, float('inf')):
+                    direction.distances[neighbour] = path_distance
+                    direction.queue[neighbour] = path_distance
+                    direction.links[neighbour] = (mask, symbol)
+                    if neighbour in other.distances:
+                        length = path_distance + other.distances[neighbour]
+                        if length < shortest:
+                            shortest = length
+                            meeting_mask = neighbour
+            stats.queue_peak = max(stats.queue_peak, 
+                                   len(forward.queue) + len(backward.queue))
+
+        if meeting_mask is None:
+            raise EndUnreachableException(stats)
+
+        path = []
+        mask = meeting_mask
+        while mask != start_mask:
+            predecessor, symbol = forward.links[mask]
+            path.append((predecessor, symbol, mask))
+            mask = predecessor
+        path.reverse()
+
+        mask = meeting_mask
+        while mask != end_mask:
+            successor, symbol = backward.links[mask]
+            path.append((mask, symbol, successor))
+            mask = successor
+
+        return path
+
+    def _search_makespan(self, start_mask, end_mask, exact, weights, heuristic,
+                         jobs, path, budget):
+        '''returns path with the lowest makespan as list of (from mask, symbol,
+        to mask)
+
+        path: a path to end, e.g. the shortest path. Its makespan bounds the
+        search, it's returned when no path finishes sooner
+
+        A path is scheduled like pyautomate.scheduler executes it: each step
+        starts on the first free worker, once the earlier steps it conflicts
+        with have finished. The makespan is when the last step finishes.
+
+        Paths to the same state can't be compared by makespan alone, a path
+        that takes longer may leave more room for concurrency. So A* is done on
+        labels: a state along with the times the workers are free and the
+        times its NFA states were last written and read. A label is pruned
+        when another label of its state is no later in all those times.
+        The A* estimate is the time the first worker is free plus the
+        heuristic, as the actions of the heuristic's chain depend on each
+        other.'''
+        if exact:
+            reached_destination = lambda: label.mask == end_mask
+        else:
+            reached_destination = lambda: label.mask & end_mask == end_mask
+
+        start = _Label(start_mask, (0,) * jobs, {}, {}, None, None)
+        label = start
+        for from_, symbol, to in path:
+            read, written = self._effects(from_, symbol, to)
+            label = label.extend(to, symbol, read, written, weights[symbol])
+        bound = label.makespan
+        verbosity.printd('makespan of shortest path:', bound)
+
+        stats = budget.stats
+        labels = {start_mask : [start]}  # mask -> [label], non-dominated labels
+        queue = PriorityQueue()  # label -> estimated makespan
+        queue[start] = heuristic(start_mask)
+
+        for label in queue:
+            if label.dominated:
+                continue
+            if reached_destination():
+                break
+
+            budget.expand()
+            for symbol, neighbour in self._get_neighbours(label.mask):
+                stats.transitions_evaluated += 1
+                if neighbour == label.mask:
+                    continue
+                read, written = self._effects(label.mask, symbol, neighbour)
+                new_label = label.extend(neighbour, symbol, read, written,
+                                         weights[symbol])
+                estimate = max(new_label.makespan,
+                               new_label.workers[0] + heuristic(neighbour))
+                if estimate >= bound:
+                    continue  # can't finish sooner than path
+                if self._add_label(labels, new_label):
+                    queue[new_label] = estimate
+            stats.queue_peak = max(stats.queue_peak, len(queue))
+        else:
+            verbosity.printd('no path finishes sooner than the shortest path')
+            return path
+
+        path = []
+        while label.predecessor is not None:
+            path.append((label.predecessor.mask, label.symbol, label.mask))
+            label = label.predecessor
+        path.reverse()
+        return path
+
+    @staticmethod
+    def _add_label(labels, label):
+        '''adds label to the labels of its state unless it's dominated, marks
+        the labels it dominates. Returns whether it was added'''
+        others = labels.setdefault(label.mask, [])
+        for other in others:
+            if other.dominates(label):
+                return False
+        for other in others:
+            if label.dominates(other):
+                other.dominated = True
+        others[:] = [other for other in others if not other.dominated]
+        others.append(label)
+        return True
+
+class SearchResult(object):
+
+    '''Result of NFAAsDFA.search'''
+
+    def __init__(self, path, stats):
+        self.path = path  # list of (from, symbol, to)
+        self.stats = stats
+
+class SearchStats(object):
+
+    '''Counters of a search'''
+
+    def __init__(self, search):
+        self.search = search  # the search that was used
+        self.nodes_expanded = 0
+        self.transitions_evaluated = 0
+        self.queue_peak = 0  # highest number of states queued at once
+        self.phases = []  # [(name, seconds)] in the order they ran
+
+    def __str__(self):
+        lines = [
+            'search: {0}'.format(self.search),
+            'nodes expanded: {0}'.format(self.nodes_expanded),
+            'transitions evaluated: {0}'.format(self.transitions_evaluated),
+            'queue peak size: {0}'.format(self.queue_peak),
+        ]
+        lines.extend('{0} time: {1:.3f}s'.format(name, seconds) 
+                     for name, seconds in self.phases)
+        return '\n'.join(lines)
+
+class _Budget(object):
+
+    '''Counts expanded states and times phases of a search, raises
+    SearchBudgetExceededException once over budget'''
+
+    def __init__(self, stats, max_nodes, max_time):
+        self.stats = stats
+        self._max_nodes = max_nodes
+        self._deadline = None
+        if max_time is not None:
+            self._deadline = time.perf_counter() + max_time
+
+    def expand(self):
+        '''call before expanding a state'''
+        if self._max_nodes is not None and self.stats.nodes_expanded >= self._max_nodes:
+            raise SearchBudgetExceededException(self.stats)
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            raise SearchBudgetExceededException(self.stats)
+        self.stats.nodes_expanded += 1
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats.phases.append((name, time.perf_counter() - started))
+
+# Expanding a state backward tries all combinations of optional states, at
+# most 2**_MAX_OPTIONAL_PREDECESSOR_STATES per symbol. States with more than
+# _MAX_PREDECESSORS predecessors make the backward search explode, e.g. a
+# reactive state whose guard isn't satisfied leaves silently, so any such state
+# may have been present.
+_MAX_OPTIONAL_PREDECESSOR_STATES = 12
+_MAX_PREDECESSORS = 256
+
+class _TooManyPredecessors(Exception):
+    pass
+
+class _Direction(object):
+
+    '''State of one direction of a bidirectional search'''
+
+    def __init__(self, mask, get_neighbours):
+        self.get_neighbours = get_neighbours
+        self.distances = {mask : 0}  # best known distance of each reached state
+        self.final = set()  # states whose distance is final
+        self.links = {}  # state -> (previous state in this direction, symbol)
+        self.queue = PriorityQueue()
+        self.queue[mask] = 0
+
+class _Label(object):
+
+    '''A path to a DFA state, scheduled on workers, see _search_makespan'''
+
+    def __init__(self, mask, workers, written, read, predecessor, symbol):
+        self.mask = mask
+        self.workers = workers  # sorted times at which each worker is free
+        self.written = written  # bit -> time it was last written
+        self.read = read  # bit -> last time it was read
+        self.predecessor = predecessor  # label this one extends
+        self.symbol = symbol  # symbol by which it extends predecessor
+        self.dominated = False
+
+    @property
+    def makespan(self):
+        return self.workers[-1]
+
+    def extend(self, mask, symbol, read, written, duration):
+        '''returns label of this path followed by symbol, which reads and
+        writes the given masks and leads to mask'''
+        bits_of = NFAAsDFA._bits_of
+        started = self.workers[0]
+        for bit in bits_of(read | written):
+            started = max(started, self.written.get(bit, 0))
+        for bit in bits_of(written):
+            started = max(started, self.read.get(bit, 0))
+        finished = started + duration
+
+        written_ = dict(self.written)
+        for bit in bits_of(written):
+            written_[bit] = finished
+        read_ = dict(self.read)
+        for bit in bits_of(read):
+            read_[bit] = max(read_.get(bit, 0), finished)
+        workers = tuple(sorted(self.workers[1:] + (finished,)))
+        return _Label(mask, workers, written_, read_, self, symbol)
 
+    def dominates(self, other):
+        '''returns whether any extension of other finishes no sooner than the
+        same extension of self'''
+        return (all(time <= other_time
+                    for time, other_time in zip(self.workers, other.workers)) and
+                all(time <= other.written.get(bit, 0)
+                    for bit, time in self.written.items()) and
+                all(time <= other.read.get(bit, 0)
+                    for bit, time in self.read.items()))
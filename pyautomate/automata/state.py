@@ -16,6 +16,7 @@
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import defaultdict
+from functools import partial
 from .statename import StateNames, StateName
 
 class _TransitionDict(defaultdict):
@@ -33,10 +34,10 @@ class State(object):
     def __init__(self, raw):
         if 'name' in raw:
             self._name = StateName(raw['name'])
-            self._transitions = _TransitionDict(lambda: frozenset((self._name,)))
+            self._transitions = _TransitionDict(partial(frozenset, (self._name,)))
         else:
             self._name = ''
-            self._transitions = _TransitionDict(lambda: frozenset())
+            self._transitions = _TransitionDict(frozenset)
 
         for raw_transition in raw['transitions']:
             target = raw_transition['to']
@@ -54,6 +55,14 @@ class State(object):
         '''
         return self._transitions[symbol]
 
+    def targets(self, symbol):
+        '''returns the state names to which symbol transitions, ignoring guards'''
+        return self._transitions[symbol]
+
+    def guard(self, symbol):
+        '''returns the state names required to transition on symbol'''
+        return frozenset()
+
     @property
     def state_names(self):
         '''returns names of target states and itself'''
@@ -34,3 +34,6 @@ class StateDict(defaultdict):
     def __missing__(self, state_name):
         return _DummyState(state_name)
 
+    def __reduce__(self):
+        return (StateDict, (), None, None, iter(self.items()))
+
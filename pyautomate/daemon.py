@@ -0,0 +1,346 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Daemon serving auto calls over a Unix domain socket
+
+auto --daemon loads the auto file and persisted data once and keeps them in
+memory, along with the compiled states, the hash caches and the planned
+paths. auto calls in the directory of the auto file are forwarded to it
+through .pyautomate.sock, saving them the startup and loading.
+
+A connection carries one call: the client sends a JSON line
+{'argv' : [...], 'cwd' : ..., 'env' : {...}} along with its stdin, stdout
+and stderr file descriptors (SCM_RIGHTS). The daemon runs the call with those
+as its standard streams and with the environment of the client, so output of
+subprocesses reaches the client too, then replies with a JSON line
+{'exit' : exit code}. Calls are served one at a time. SIGTERM ends the call
+being served with exit code 143, as if it was killed, and stops the daemon.
+
+Only calls of the auto file the daemon runs are served, for a call of
+another auto file in its directory the daemon replies {'exit' : null} and the
+client runs the call itself.
+
+This module is imported by the client before anything else, keep its imports
+light.
+'''
+
+import array
+import json
+import os
+import socket
+import sys
+from contextlib import contextmanager
+
+SOCKET_NAME = '.pyautomate.sock'
+
+# stdin, stdout and stderr
+_STANDARD_FDS = (0, 1, 2)
+
+# options of auto, see Application._parse_args, and whether they take a value
+_OPTIONS = {
+    '--file' : True, '-f' : True, '--exact' : False, '-e' : False,
+    '--search' : True, '--jobs' : True, '-j' : True,
+    '--measured-weights' : False, '--max-nodes' : True, '--max-time' : True,
+    '--stats' : False, '--verbosity' : True, '-v' : True,
+    '--hash-workers' : True, '--storage' : True, '--fsync-interval' : True,
+    '--daemon' : False, '--version' : False, '--help' : False, '-h' : False,
+}
+
+class NotServed(Exception):
+
+    '''Raised by the handle function of serve for a call of another auto
+    file, the client then runs the call itself'''
+
+class _Terminated(BaseException):
+
+    '''Raised in the daemon on SIGTERM
+
+    Not a SystemExit, which would end only the call being served.'''
+
+def _terminate(signal_number, frame):
+    raise _Terminated()
+
+def forward(argv):
+    '''runs auto with command line arguments argv in the daemon serving its
+    auto file
+
+    Returns the exit code, or None when no daemon serves the call.'''
+    auto_path, daemon = _parse_argv(argv)
+    if daemon:
+        return None
+    auto_dir = os.path.dirname(os.path.abspath(auto_path))
+    if not all(_is_open(fd) for fd in _STANDARD_FDS):
+        return None
+    client = _connect(os.path.join(auto_dir, SOCKET_NAME))
+    if client is None:
+        return None
+    with client:
+        request = json.dumps({'argv' : argv, 'cwd' : os.getcwd(), 
+                              'env' : dict(os.environ)}) + '\n'
+        _send_with_fds(client, request.encode('UTF-8'), _STANDARD_FDS)
+        with client.makefile('r', encoding='UTF-8') as f:
+            reply = f.readline()
+    if not reply:
+        print('auto: error: daemon stopped before finishing', file=sys.stderr)
+        return 1
+    return json.loads(reply)['exit']  # None if the daemon runs another file
+
+def _is_open(fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        return False
+    return True
+
+def _send_with_fds(connection, data, fds):
+    '''sends data, passing fds along with its first bytes'''
+    sent = connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                        array.array('i', fds))])
+    if sent < len(data):
+        connection.sendall(data[sent:])
+
+def _receive_with_fds(connection, fd_count):
+    '''returns (line, fds) received on connection, line is empty when the
+    connection was closed before a line was received'''
+    fds = array.array('i')
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk, ancillary_data, flags, address = connection.recvmsg(
+            65536, socket.CMSG_SPACE(fd_count * fds.itemsize))
+        for level, type_, fd_data in ancillary_data:
+            if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+                fds.frombytes(fd_data[:len(fd_data) - len(fd_data) % fds.itemsize])
+        if not chunk:
+            return b'', list(fds)
+        data += chunk
+    return data, list(fds)
+
+def _parse_argv(argv):
+    '''returns (--file argument, whether --daemon is given) of argv
+
+    Follows the rules of argparse, which takes too long to import here: long
+    options may be abbreviated and take a value after '=', short options may
+    be combined, e.g. -ef auto.py, and take a value right after them. Invalid
+    arguments are skipped, the daemon reports them like auto would.'''
+    auto_path = 'auto.py'
+    daemon = False
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument == '--':
+            break
+        if not _is_option(argument):
+            continue
+        name, equals, value = argument.partition('=')
+        if argument.startswith('--'):
+            options = [(_expand_abbreviation(name), value if equals else None)]
+        elif equals and name in _OPTIONS:
+            options = [(name, value)]
+        else:
+            # combined short options, the first one taking a value takes the
+            # rest of the argument
+            options = []
+            for i, char in enumerate(argument[1:], 2):
+                name = '-' + char
+                if _OPTIONS.get(name, False):
+                    options.append((name, argument[i:] or None))
+                    break
+                options.append((name, None))
+        for name, value in options:
+            if _OPTIONS.get(name) and value is None:
+                value = next(arguments, None)
+                if value is None:
+                    break
+                if _is_option(value):
+                    continue  # missing value
+            if name in ('--file', '-f'):
+                auto_path = value
+            elif name == '--daemon':
+                daemon = True
+    return auto_path, daemon
+
+def _is_option(argument):
+    '''returns whether argparse takes argument for an option rather than a
+    value'''
+    if not argument.startswith('-') or argument == '-' or ' ' in argument:
+        return False
+    try:
+        float(argument)
+    except ValueError:
+        return True
+    return False  # a negative number
+
+def _expand_abbreviation(name):
+    '''returns the long option name abbreviates, or name when it's not a
+    unique abbreviation'''
+    if name in _OPTIONS:
+        return name
+    matches = [option for option in _OPTIONS if option.startswith(name)]
+    return matches[0] if len(matches) == 1 else name
+
+def _connect(path):
+    '''returns socket connected to path, or None if nothing listens there'''
+    if not os.path.exists(path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None  # left behind by a daemon that was killed
+    return client
+
+def serve(handle):
+    '''serves calls until interrupted
+
+    handle: f(argv, cwd), runs a call. It runs with the standard streams
+    and the environment of the client, SystemExit ends the call with its
+    code. NotServed makes the client run the call itself. On SIGTERM the
+    call ends with exit code 143 and serving stops.
+
+    Raises OSError when a daemon is already running in the current
+    directory.'''
+    import signal
+
+    path = os.path.abspath(SOCKET_NAME)
+    client = _connect(path)
+    if client is not None:
+        client.close()
+        raise OSError('A daemon is already running at {0}'.format(path))
+    if os.path.exists(path):
+        os.remove(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # only the owner may connect
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(5)
+
+    # stop cleanly when killed
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        while True:
+            connection, address = server.accept()
+            with connection:
+                _serve(connection, handle)
+    except (KeyboardInterrupt, _Terminated):
+        pass
+    finally:
+        server.close()
+        os.remove(path)
+
+def _serve(connection, handle):
+    '''serves the call on connection
+
+    Raises _Terminated after replying when SIGTERM ended the call.'''
+    import signal
+    import traceback
+
+    terminated = False
+    line, fds = _receive_with_fds(connection, len(_STANDARD_FDS))
+    try:
+        try:
+            request = json.loads(line.decode('UTF-8'))
+        except ValueError:
+            return  # not a client
+        if len(fds) != len(_STANDARD_FDS):
+            return
+
+        with _standard_streams(fds), _environment(request['env']):
+            try:
+                handle(request['argv'], request['cwd'])
+                exit_code = 0
+            except SystemExit as ex:
+                exit_code = _get_exit_code(ex)
+            except NotServed:
+                exit_code = None
+            except _Terminated:
+                print('auto: error: daemon terminated', file=sys.stderr)
+                exit_code = 128 + signal.SIGTERM
+                terminated = True
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+    try:
+        connection.sendall((json.dumps({'exit' : exit_code}) + '\n').encode('UTF-8'))
+    except OSError:
+        pass  # the client went away
+    if terminated:
+        raise _Terminated()
+
+@contextmanager
+def _standard_streams(fds):
+    '''makes fds the standard streams of the process, for subprocesses too'''
+    streams = ('stdin', 'stdout', 'stderr')
+    originals = [getattr(sys, name) for name in streams]
+    _flush(originals)
+    saved_fds = [os.dup(fd) for fd in _STANDARD_FDS]
+    try:
+        for fd, client_fd in zip(_STANDARD_FDS, fds):
+            os.dup2(client_fd, fd)
+        # buffered like the streams of an interpreter started on fds
+        clients = [open(fd, 'r' if fd == 0 else 'w', closefd=False,
+                        encoding=getattr(original, 'encoding', None),
+                        errors=getattr(original, 'errors', None),
+                        buffering=1 if fd == 2 or (fd == 1 and os.isatty(fd)) else -1)
+                   for fd, original in zip(_STANDARD_FDS, originals)]
+        for name, stream in zip(streams, clients):
+            setattr(sys, name, stream)
+        try:
+            yield
+        finally:
+            _flush(clients)
+            for name, stream in zip(streams, originals):
+                setattr(sys, name, stream)
+    finally:
+        for fd, saved_fd in zip(_STANDARD_FDS, saved_fds):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+
+def _flush(streams):
+    for stream in streams:
+        try:
+            stream.flush()
+        except (AttributeError, OSError, ValueError):
+            pass  # closed, or the client went away
+
+@contextmanager
+def _environment(env):
+    '''replaces os.environ by env'''
+    original = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(original)
+
+def _get_exit_code(ex):
+    '''returns exit code of SystemExit, like the interpreter would'''
+    if ex.code is None:
+        return 0
+    if isinstance(ex.code, int):
+        return ex.code
+    print(ex.code, file=sys.stderr)
+    return 1
@@ -15,34 +15,178 @@
 # You should have received a copy of the GNU General Public License
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
-import os.path
-import yaml
+import threading
+from collections.abc import MutableMapping
 
-class Data(dict):
+from .journal import Journal
+from .storage import open_storage
 
-    def __init__(self):
-        dict.__init__(self)
-        try:
-            with self._open('r') as f:
-                self.update(yaml.load(f))
-        except IOError:
-            self.update({
-                'last_state' : {}
-            })
+# Values of these types can't be changed in place
+_IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None), tuple, frozenset)
+
+# Marks a deleted key in a layer of changes
+_DELETED = object()
+
+class PersistedDict(MutableMapping):
+
+    '''Dictionary whose items are read from a storage on first access
+
+    Changes are kept in two layers on top of the storage: committed changes
+    and pending changes. commit moves the pending changes to the committed
+    layer, rollback discards them. Both only cost as much as the number of
+    keys touched since the last commit. Only the committed changes need to be
+    written back.
+
+    Mutable values that are read count as changed, they may be modified in
+    place.
+
+    Each thread has its own pending changes, so actions executed concurrently
+    commit or roll back independently.'''
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._read = {}  # unchanged items read from storage
 
+        # {key : value or _DELETED}
         self._committed = {}
-        self.commit()
+        self._local = threading.local()  # pending of each thread
+
+        self._lock = threading.RLock()
+
+    @property
+    def _pending(self):
+        try:
+            return self._local.pending
+        except AttributeError:
+            self._local.pending = {}
+            return self._local.pending
+
+    def _get(self, key):
+        '''returns value of key or _DELETED, without marking it changed'''
+        with self._lock:
+            for layer in (self._pending, self._committed, self._read):
+                if key in layer:
+                    return layer[key]
+            try:
+                value = self._storage.get(key)
+            except KeyError:
+                return _DELETED
+            self._read[key] = value
+            return value
+
+    def __getitem__(self, key):
+        value = self._get(key)
+        if value is _DELETED:
+            raise KeyError(key)
+        if not isinstance(value, _IMMUTABLE_TYPES):
+            self._pending[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._pending[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._pending[key] = _DELETED
+
+    def __contains__(self, key):
+        return self._get(key) is not _DELETED
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def _keys(self):
+        with self._lock:
+            keys = set(self._storage.keys())
+            for layer in (self._committed, self._pending):
+                for key, value in layer.items():
+                    if value is _DELETED:
+                        keys.discard(key)
+                    else:
+                        keys.add(key)
+            return keys
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def commit(self):
+        '''makes pending changes part of the committed changes'''
+        with self._lock:
+            self._committed.update(self._pending)
+        self._pending.clear()
+
+    def rollback(self):
+        '''discards pending changes'''
+        self._pending.clear()
+
+    def pending_changes(self):
+        '''returns ({key : value} of changed keys, set of deleted keys) of the
+        current thread since its last commit'''
+        return _split(self._pending)
+
+    def committed_changes(self):
+        '''returns ({key : value} of changed keys, set of deleted keys)'''
+        with self._lock:
+            return _split(self._committed)
+
+    def saved(self):
+        '''forgets the committed changes, call after writing them to storage'''
+        with self._lock:
+            for key, value in self._committed.items():
+                if value is _DELETED:
+                    self._read.pop(key, None)
+                else:
+                    self._read[key] = value
+            self._committed.clear()
+
+def _split(changes):
+    changed = {}
+    deleted = set()
+    for key, value in changes.items():
+        if value is _DELETED:
+            deleted.add(key)
+        else:
+            changed[key] = value
+    return changed, deleted
+
+class Data(dict):
+
+    '''Data persisted between runs
+
+    Commits are journaled as they happen, save writes them to the storage.'''
+
+    def __init__(self, storage_name=None, fsync_interval=1):
+        dict.__init__(self)
+        self._storage = open_storage(storage_name)
+        self._journal = Journal(fsync_interval)
+        self._journal.replay(self._storage)
+        self._lock = threading.Lock()
+        self['last_state'] = PersistedDict(self._storage)
 
         import pyautomate
         pyautomate.persisted = self['last_state']
 
-    def _open(self, access):
-        return open(os.path.abspath('.pyautomate'), access)
-
     def save(self):
-        with self._open('w') as f:
-            yaml.dump(self._committed, f)
+        '''writes committed changes to storage'''
+        with self._lock:
+            self._storage.write(*self['last_state'].committed_changes())
+            self['last_state'].saved()
+            self._journal.remove()
+
+    def close(self):
+        '''closes the storage, call after save'''
+        self._storage.close()
 
     def commit(self):
-        self._committed['last_state'] = self['last_state'].copy()
+        '''commits the changes the current thread made since its last commit'''
+        with self._lock:
+            self._journal.append(*self['last_state'].pending_changes())
+            self['last_state'].commit()
 
+    def rollback(self):
+        '''discards the changes the current thread made since its last commit'''
+        self['last_state'].rollback()
@@ -0,0 +1,96 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measured durations of actions
+
+The duration of each executed action is kept as a moving average in
+milliseconds, so the default weight of 1000 amounts to a second. Recent runs
+count most, older runs decay.
+'''
+
+import json
+import os.path
+import threading
+
+# How much the latest duration counts in the average, the rest is the average
+# of the earlier ones
+_SMOOTHING = 0.3
+
+class Durations(object):
+
+    def __init__(self, file_name):
+        self._file_name = file_name
+        self._path = None
+        self._contents = None
+        self._changed = False
+        self._lock = threading.Lock()
+
+    @property
+    def _durations(self):
+        '''{action : average duration in ms}'''
+        if self._contents is None:
+            self._path = os.path.abspath(self._file_name)
+            try:
+                with open(self._path, 'r') as f:
+                    contents = json.load(f)
+                if 'durations' not in contents:
+                    raise ValueError('Unknown format')
+            except (IOError, ValueError):
+                contents = {'durations' : {}}
+            self._contents = contents
+        return self._contents['durations']
+
+    def record(self, action, seconds):
+        '''adds a measured duration of action to its average
+
+        seconds: measured with a monotonic clock, durations that aren't
+        positive are ignored'''
+        if not seconds > 0:
+            return
+        with self._lock:
+            milliseconds = seconds * 1000
+            if action in self._durations:
+                milliseconds = _SMOOTHING * milliseconds + \
+                    (1 - _SMOOTHING) * self._durations[action]
+            self._durations[action] = milliseconds
+            self._changed = True
+
+    def get_weights(self, weights, actions):
+        '''returns copy of weights with the average duration of each of actions
+        that was measured before
+
+        Durations are rounded to 2 significant digits, so small differences
+        between runs don't invalidate cached plans.'''
+        weights = weights.copy()
+        for action in actions:
+            if action in self._durations:
+                milliseconds = float('{0:.2g}'.format(self._durations[action]))
+                weights[action] = max(milliseconds, 1)
+        return weights
+
+    def save(self):
+        if not self._changed:
+            return
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self._contents, f)
+        os.replace(temporary_path, self._path)
+        self._changed = False
+
+durations = Durations('.pyautomate.durations')
+del Durations
@@ -16,45 +16,258 @@
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
 import hashlib
-import os.path
+import mmap
+import os
+import re
+import stat
+import threading
+from concurrent.futures import Future
+from functools import partial
 from pyautomate.manifest import generate_manifest
 from pyautomate.helpers import files_exist
+from pyautomate.hashcache import hash_cache
+from pyautomate.treehash import hash_tree
+from pyautomate.watcher import watcher
 
-def hash_(*files, alg_name='sha256'):
-    alg = getattr(hashlib, alg_name)
+# Default number of threads used to hash the files of a directory. Set from
+# --hash-workers or PYAUTOMATE_HASH_WORKERS by the application
+default_workers = 1
+
+# Files up to this size are read with a single read
+_SMALL_FILE_SIZE = 2**20
+
+# Files of at least this size are memory-mapped
+_LARGE_FILE_SIZE = 64 * 2**20
+
+# Read buffer of each thread for files between small and large
+_buffers = threading.local()
+
+# {key : Future} of digests being computed, see _single_flight
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def hash_(*files, alg_name='sha256', workers=None, tree=False):
+    '''returns digest of files and directories, or None if any is missing
+
+    alg_name: name of the hash algorithm, see get_alg. Use a fast one such as
+    blake2b-128 or xxh3_128 (if xxhash is installed) when digests need not be
+    cryptographically strong
+    workers: number of threads hashing files of directories in parallel
+    (default: PYAUTOMATE_HASH_WORKERS or 1)
+    tree: whether to return a Merkle tree digest instead, which allows a
+    tracker to tell which subtrees changed'''
+    if workers is None:
+        workers = default_workers
+    alg = get_alg(alg_name)
+    watcher.sync(files)
     if not files or not files_exist(*files):
         return None
 
+    if tree:
+        return hash_tree(files, alg_name, workers)
+
     if len(files) == 1:
-        digest = hash_one(files[0], alg).hexdigest()
+        digest = hash_one(files[0], alg_name, workers)
     else:
         digest = alg()
         for file in files:
-            digest.update(hash_one(file, alg).digest())
+            digest.update(bytes.fromhex(hash_one(file, alg_name, workers)))
         digest = digest.hexdigest()
     return alg_name + '=' + digest
 
-def hash_one(path, alg):
+def quick_hash_(*files, verify=False, alg_name='sha256', workers=None):
+    '''returns stat fingerprint of files and directories, or None if any is
+    missing
+
+    The fingerprint is derived from the names, types, sizes, modification
+    times and inodes of the files only, their contents aren't read.
+
+    verify: if True, return the digest hash_ would return instead, but only
+    compute it when the fingerprint differs from the one it was last computed
+    for. A file that is touched without changing its contents then doesn't
+    count as a change.'''
+    if not files or not files_exist(*files):
+        return None
+
+    fingerprint, newest_mtime_ns = _stat_fingerprint(files)
+    if not verify:
+        return 'stat=' + fingerprint
+
+    key = '\0'.join([alg_name] + [os.path.abspath(file) for file in files])
+    digest = hash_cache.get_fingerprinted(key, fingerprint)
+    if digest is None:
+        digest = hash_(*files, alg_name=alg_name, workers=workers)
+        hash_cache.set_fingerprinted(key, fingerprint, newest_mtime_ns, digest)
+    return digest
+
+def _stat_fingerprint(paths):
+    '''returns (hex fingerprint, newest mtime_ns) of existing paths'''
+    fingerprint = hashlib.blake2b(digest_size=16)
+    newest_mtime_ns = 0
+
+    def add(name, info):
+        nonlocal newest_mtime_ns
+        newest_mtime_ns = max(newest_mtime_ns, info.st_mtime_ns)
+        fingerprint.update(('%s\0%o %d %d %d\n' % (
+            name, info.st_mode, info.st_size, info.st_mtime_ns, info.st_ino
+        )).encode('UTF-8', 'surrogateescape'))
+
+    for path in paths:
+        info = os.stat(path)
+        add(path, info)
+        if not stat.S_ISDIR(info.st_mode):
+            continue
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+            for entry in entries:
+                info = entry.stat(follow_symlinks=False)
+                add(entry.path, info)
+                if stat.S_ISDIR(info.st_mode):
+                    pending.append(entry.path)
+
+    return fingerprint.hexdigest(), newest_mtime_ns
+
+# {alg_name : callable returning a new hash object, optionally given data}
+_algs = {}
+
+def register_alg(alg_name, alg):
+    '''makes alg available to hash_ as alg_name
+
+    alg: callable returning a new hashlib-like hash object, optionally given
+    initial data'''
+    if '=' in alg_name:
+        raise ValueError("Algorithm name may not contain '=': %s" % alg_name)
+    _algs[alg_name] = alg
+
+def get_alg(alg_name):
+    '''returns hash algorithm by name
+
+    Known names are those registered with register_alg, those of hashlib and
+    blake2b-<bits> or blake2s-<bits> for blake2 with a shorter digest, e.g.
+    blake2b-128'''
+    if alg_name not in _algs:
+        match = re.fullmatch(r'(blake2[bs])-([0-9]+)', alg_name)
+        if match:
+            bits = int(match.group(2))
+            alg = getattr(hashlib, match.group(1))
+            if bits % 8 or not 0 < bits // 8 <= alg.MAX_DIGEST_SIZE:
+                raise ValueError('Invalid digest size: %s' % alg_name)
+            _algs[alg_name] = partial(alg, digest_size=bits // 8)
+        elif alg_name in hashlib.algorithms_guaranteed:
+            _algs[alg_name] = getattr(hashlib, alg_name)
+        elif alg_name in hashlib.algorithms_available:
+            _algs[alg_name] = partial(hashlib.new, alg_name)
+        else:
+            raise ValueError('Unknown hash algorithm: %s' % alg_name)
+    return _algs[alg_name]
+
+def _register_xxhash():
+    try:
+        import xxhash
+    except ImportError:
+        return
+    for alg_name in ('xxh32', 'xxh64', 'xxh3_64', 'xxh3_128'):
+        if hasattr(xxhash, alg_name):
+            register_alg(alg_name, getattr(xxhash, alg_name))
+
+_register_xxhash()
+
+def hash_one(path, alg_name, workers=1):
     # Note: path must exist
+    digest = watcher.get(os.path.realpath(path), ('directory', alg_name), tree=True)
+    if digest is not None:
+        return digest  # an unchanged directory
     if os.path.isdir(path):
-        return hash_directory(path, alg)
+        return _single_flight(('D', os.path.abspath(path), alg_name),
+                              lambda: hash_directory(path, alg_name, workers))
+    else:
+        return hash_file(path, alg_name)
+
+def _single_flight(key, compute):
+    '''returns compute(), or the result of a concurrent call with the same key
+
+    Lets trackers evaluated in parallel share the hashing of overlapping
+    paths.'''
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+
+    if not owner:
+        return future.result()
+
+    try:
+        result = compute()
+    except BaseException as ex:
+        future.set_exception(ex)
+        raise
     else:
-        return hash_file(path, alg)
+        future.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
 
-def hash_file(path, alg):
-    block_size = 128 * 63
-    with open(path,'rb') as f: 
-        chunks = iter(lambda: f.read(block_size), b'')
-        return hash_iterable(chunks, alg)
+def hash_file(path, alg_name, info=None):
+    '''returns hex digest of file, rehashing only if its stat signature changed
 
-def hash_directory(path, alg):
+    info: stat result of path, if already known'''
+    path = os.path.abspath(path)
+    if info is None:
+        info = os.stat(path)
+
+    digest = hash_cache.get(path, info, alg_name)
+    if digest is None:
+        def compute():
+            digest = _digest_file(path, get_alg(alg_name), info.st_size).hexdigest()
+            hash_cache.set(path, info, alg_name, digest)
+            return digest
+        digest = _single_flight(('F', path, alg_name), compute)
+    return digest
+
+def _digest_file(path, alg, size):
+    '''returns digest of file contents, choosing how to read by file size'''
+    with open(path, 'rb') as f:
+        if size <= _SMALL_FILE_SIZE:
+            return alg(f.read())
+
+        if size >= _LARGE_FILE_SIZE:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mapped, 'madvise'):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    return alg(mapped)
+            except (OSError, ValueError):
+                pass  # not mappable, e.g. on some special file systems
+
+        return _digest_stream(f, alg)
+
+def _digest_stream(f, alg):
+    if not hasattr(_buffers, 'buffer'):
+        _buffers.buffer = bytearray(_SMALL_FILE_SIZE)
+    view = memoryview(_buffers.buffer)
+    digest = alg()
+    while True:
+        size = f.readinto(view)
+        if not size:
+            return digest
+        digest.update(view[:size])
+
+def hash_directory(path, alg_name, workers=1):
+    directory = os.path.realpath(path)
+    token = watcher.watch(directory)
     lines = ((line + '\n').encode('UTF-8') 
-            for line in generate_manifest(path, alg))
-    return hash_iterable(lines, alg)
+            for line in generate_manifest(path, alg_name, workers))
+    digest = hash_iterable(lines, get_alg(alg_name)).hexdigest()
+    watcher.set(directory, ('directory', alg_name), digest, token, tree=True)
+    return digest
 
 def hash_iterable(iterable, alg):
     digest = alg()
     for chunk in iterable:
         digest.update(chunk)
     return digest
-
@@ -0,0 +1,135 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Persistent cache of file digests
+
+A file is only rehashed when its stat signature (device, inode, size and
+modification time) differs from the one it had when it was last hashed.
+Similarly, the digest of a set of files is kept along with the stat
+fingerprint of the set (see quick_hash_).
+
+When the cache is saved, entries that weren't looked up since the last save
+and whose files no longer exist are dropped, so that deleted and renamed
+files don't accumulate.
+'''
+
+import json
+import os.path
+import threading
+import time
+
+# Files modified this recently may still change within the timestamp
+# granularity of the file system, their digests aren't cached
+_RACY_NS = 2 * 10**9
+
+class HashCache(object):
+
+    def __init__(self, file_name):
+        self._file_name = file_name
+        self._path = None
+        self._entries = None
+        self._changed = False
+        self._used = set()  # paths and fingerprint keys looked up since saving
+        self._lock = threading.Lock()
+
+    @property
+    def _cache(self):
+        '''{'files' : {alg_name : {path : [dev, ino, size, mtime_ns, hexdigest]}},
+        'fingerprints' : {key : [fingerprint, digest]}}'''
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._path = os.path.abspath(self._file_name)
+                    try:
+                        with open(self._path, 'r') as f:
+                            entries = json.load(f)
+                        if 'files' not in entries:
+                            raise ValueError('Unknown format')
+                    except (IOError, ValueError):
+                        entries = {'files' : {}, 'fingerprints' : {}}
+                    self._entries = entries
+        return self._entries
+
+    def get(self, path, info, alg_name):
+        '''returns cached hex digest of file at absolute path, or None
+
+        info: stat result of path'''
+        self._used.add(path)
+        entry = self._cache['files'].get(alg_name, {}).get(path)
+        if entry and entry[:4] == _signature(info):
+            return entry[4]
+        return None
+
+    def set(self, path, info, alg_name, digest):
+        if _is_racy(info.st_mtime_ns):
+            return
+        self._cache['files'].setdefault(alg_name, {})[path] = \
+            _signature(info) + [digest]
+        self._changed = True
+
+    def get_fingerprinted(self, key, fingerprint):
+        '''returns digest stored for key if stored with fingerprint, or None
+
+        key: alg_name and the absolute paths of the files, joined by NUL'''
+        self._used.add(key)
+        entry = self._cache['fingerprints'].get(key)
+        if entry and entry[0] == fingerprint:
+            return entry[1]
+        return None
+
+    def set_fingerprinted(self, key, fingerprint, newest_mtime_ns, digest):
+        '''stores digest of files along with their stat fingerprint
+
+        newest_mtime_ns: most recent modification time among the files'''
+        if _is_racy(newest_mtime_ns):
+            return
+        self._cache['fingerprints'][key] = [fingerprint, digest]
+        self._changed = True
+
+    def save(self):
+        if not self._changed:
+            return
+        self._prune()
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temporary_path, self._path)
+        self._changed = False
+
+    def _prune(self):
+        '''drops entries not looked up since the last save whose files are gone'''
+        used = self._used
+        self._used = set()
+        for files in self._entries['files'].values():
+            for path in [path for path in files
+                         if path not in used and not os.path.lexists(path)]:
+                del files[path]
+        fingerprints = self._entries['fingerprints']
+        for key in [key for key in fingerprints if key not in used and
+                    not all(os.path.lexists(path) for path in key.split('\0')[1:])]:
+            del fingerprints[key]
+
+def _is_racy(mtime_ns):
+    return mtime_ns > time.time_ns() - _RACY_NS
+
+def _signature(info):
+    return [info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns]
+
+hash_cache = HashCache('.pyautomate.hashes')
+del HashCache
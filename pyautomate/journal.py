@@ -0,0 +1,116 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Write-ahead journal of commits to persisted data
+
+Each commit is appended to .pyautomate.journal as it happens, so that it
+survives the process being killed. On a clean exit the committed changes are
+written to the storage and the journal is removed. A journal that is left
+behind is replayed into the storage on the next start.
+
+Each record is a header line with the length and CRC32 of its payload,
+followed by the payload: a YAML mapping of changed values and a list of
+deleted keys. A partially written last record is ignored.
+'''
+
+import os.path
+import yaml
+import zlib
+
+class Journal(object):
+
+    def __init__(self, fsync_interval=1):
+        '''
+        fsync_interval: number of records after which the journal is flushed to
+        disk, 0 to leave it to the OS
+        '''
+        self._path = os.path.abspath('.pyautomate.journal')
+        self._fsync_interval = fsync_interval
+        self._file = None
+        self._unsynced = 0
+
+    def replay(self, storage):
+        '''writes the changes of a left-behind journal to storage, then
+        removes the journal'''
+        try:
+            with open(self._path, 'rb') as f:
+                contents = f.read()
+        except IOError:
+            return
+
+        changed = {}
+        deleted = set()
+        for record_changed, record_deleted in _records(contents):
+            for key in record_deleted:
+                changed.pop(key, None)
+                deleted.add(key)
+            for key, value in record_changed.items():
+                deleted.discard(key)
+                changed[key] = value
+        storage.write(changed, deleted)
+        os.remove(self._path)
+
+    def append(self, changed, deleted):
+        '''durably records a commit, subject to the fsync interval
+
+        changed: {key : value}
+        deleted: iterable of keys'''
+        if not changed and not deleted:
+            return
+        if self._file is None:
+            self._file = open(self._path, 'ab')
+
+        payload = yaml.dump({'changed' : changed, 'deleted' : list(deleted)},
+                            Dumper=getattr(yaml, 'CDumper', yaml.Dumper)
+                           ).encode('UTF-8')
+        self._file.write(b'%d %d\n' % (len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self._file.flush()
+
+        self._unsynced += 1
+        if self._fsync_interval and self._unsynced >= self._fsync_interval:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def remove(self):
+        '''removes the journal, call after its changes are in storage'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+def _records(contents):
+    '''yields (changed, deleted) of each complete record in journal contents'''
+    offset = 0
+    while True:
+        header_end = contents.find(b'\n', offset)
+        if header_end == -1:
+            return
+        try:
+            length, checksum = map(int, contents[offset:header_end].split())
+        except ValueError:
+            return
+        payload = contents[header_end + 1 : header_end + 1 + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return
+        record = yaml.load(payload.decode('UTF-8'),
+                           Loader=getattr(yaml, 'CLoader', yaml.Loader))
+        yield record['changed'], record['deleted']
+        offset = header_end + 1 + length
@@ -15,6 +15,26 @@
 # You should have received a copy of the GNU General Public License
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
+import os.path
+import sys
+
+def _forward():
+    '''forwards the call to the daemon serving its auto file, if one is
+    running
+
+    The daemon module is loaded by path as importing pyautomate takes longer
+    than a forwarded call.'''
+    from importlib.util import module_from_spec, spec_from_file_location
+    spec = spec_from_file_location('pyautomate.daemon',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'daemon.py'))
+    daemon = module_from_spec(spec)
+    spec.loader.exec_module(daemon)
+    exit_code = daemon.forward(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+_forward()
+
 from pyautomate.application import application
 application.run()
 
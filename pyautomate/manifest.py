@@ -2,58 +2,151 @@
 # http://0install.net/2007/interfaces/ZeroInstall.xml
 
 import os, stat
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def generate_manifest(root, alg):
-    def recurse(subdir):
-        # To ensure that a line-by-line comparison of the manifests
-        # is possible, we require that filenames don't contain newlines.
-        # Otherwise, you can name a file so that the part after the \n
-        # would be interpreted as another line in the manifest.
-        if '\n' in subdir: raise Exception("Newline in filename '%s'" %
-                                           subdir)
-        assert subdir.startswith('/')
-
-        full = os.path.join(root, subdir[1:])
-        
-        if not os.path.isdir(full): 
-            raise Exception('Not a directory: "%s"' % full)
-
-        if subdir != '/':
-            yield "D %s" % subdir
-
-        items = os.listdir(full)
-        items.sort()
-        dirs = []
-        for item in items:
-            path = os.path.join(root, subdir[1:], item)
-            info = os.lstat(path)
-            m = info.st_mode
-
-            if stat.S_ISREG(m):
-                d = hash_file(path, alg).hexdigest()
-                if m & 0o111:
-                    yield "X %s %s %s" % (d, info.st_size, item)
-                else:
-                    yield "F %s %s %s" % (d, info.st_size, item)
-            elif stat.S_ISLNK(m):
-                target = os.readlink(path)
-                d = alg(target).hexdigest()
-                # Note: Can't use utime on symlinks, so skip mtime
-                # Note: eCryptfs may report length as zero, so count ourselves instead
-                yield "S %s %s %s" % (d, len(target), item)
-            elif stat.S_ISDIR(m):
-                dirs.append(item)
+def generate_manifest(root, alg_name, workers=1):
+    '''yields manifest lines of directory at root
+
+    workers: number of threads hashing files in parallel, lines are yielded in
+    the same order regardless
+
+    The listings of directories that didn't change since they were last
+    listed are taken from the watcher, if it's running.'''
+    from pyautomate.hash import hash_file, get_alg
+    from pyautomate.watcher import watcher
+
+    key = ('manifest', alg_name)
+    # subdirectories are not symlinks, so joining them keeps the path real
+    real_root = os.path.realpath(root)
+    listed = {}  # subdir -> (directory, token, dirs) of subdirs listed by walk
+
+    def walk():
+        if not os.path.isdir(root):
+            raise Exception('Not a directory: "%s"' % root)
+
+        # Directories still to list, the next one last. Listing a directory
+        # pushes its subdirectories in reverse order, which yields the same
+        # depth-first order as recursing into them one by one.
+        pending = ['/']
+        while pending:
+            subdir = pending.pop()
+
+            # To ensure that a line-by-line comparison of the manifests
+            # is possible, we require that filenames don't contain newlines.
+            # Otherwise, you can name a file so that the part after the \n
+            # would be interpreted as another line in the manifest.
+            if '\n' in subdir: raise Exception("Newline in filename '%s'" %
+                                               subdir)
+            assert subdir.startswith('/')
+
+            if subdir != '/':
+                yield "D %s" % subdir
+
+            directory = os.path.abspath(os.path.join(real_root, subdir[1:]))
+            listing = watcher.get(directory, key)
+            if listing is not None:
+                lines, dirs = listing
+                for line in lines:
+                    yield line
             else:
-                raise Exception("Unknown object '%s' (not a file, directory or symlink)" %
-                        path)
+                token = watcher.watch(directory)
+                with os.scandir(directory) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+
+                # Note: the type of an entry usually comes with the listing, only
+                # regular files need a stat call (for their size and mode)
+                dirs = []
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        # file line, digest is filled in later
+                        yield (entry.path, entry.stat(follow_symlinks=False), entry.name)
+                    elif entry.is_symlink():
+                        target = os.readlink(entry.path)
+                        d = get_alg(alg_name)(os.fsencode(target)).hexdigest()
+                        # Note: Can't use utime on symlinks, so skip mtime
+                        # Note: eCryptfs may report length as zero, so count ourselves instead
+                        yield "S %s %s %s" % (d, len(target), entry.name)
+                    elif entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    else:
+                        raise Exception("Unknown object '%s' (not a file, directory or symlink)" %
+                                entry.path)
 
-        if not subdir.endswith('/'):
-            subdir += '/'
-        for x in dirs:
+                if watcher.running:
+                    listed[subdir] = (directory, token, dirs)
+
+            if not subdir.endswith('/'):
+                subdir += '/'
             # Note: "subdir" is always Unix style. Don't use os.path.join here.
-            for y in recurse(subdir + x): yield y
-        return
+            pending.extend(subdir + x for x in reversed(dirs))
+
+    def hash_(entry):
+        path, info, item = entry
+        return hash_file(path, alg_name, info)
+
+    def file_line(entry, d):
+        path, info, item = entry
+        if info.st_mode & 0o111:
+            return "X %s %s %s" % (d, info.st_size, item)
+        else:
+            return "F %s %s %s" % (d, info.st_size, item)
+
+    def remember(lines):
+        '''yields lines, storing the listings of the directories walk listed'''
+        subdir = '/'
+        own_lines = []
+        for line in lines:
+            if line.startswith('D '):
+                store(subdir, own_lines)
+                subdir = line[2:]
+                own_lines = []
+            else:
+                own_lines.append(line)
+            yield line
+        store(subdir, own_lines)
+
+    def store(subdir, lines):
+        if subdir in listed:
+            directory, token, dirs = listed.pop(subdir)
+            watcher.set(directory, key, (lines, dirs), token)
+
+    def lines():
+        if workers > 1:
+            for x in _hash_in_parallel(walk(), hash_, file_line, workers):
+                yield x
+        else:
+            for x in walk():
+                if isinstance(x, str):
+                    yield x
+                else:
+                    yield file_line(x, hash_(x))
+
+    if watcher.running:
+        for x in remember(lines()):
+            yield x
+    else:
+        for x in lines():
+            yield x
+
+def _hash_in_parallel(entries, hash_, file_line, workers):
+    '''yields lines of entries in order while hashing files in a thread pool'''
+    # number of lines that may be pending at any time
+    window = workers * 64
 
-    for x in recurse('/'): yield x
+    def resolve(x):
+        if isinstance(x, str):
+            return x
+        entry, future = x
+        return file_line(entry, future.result())
 
-from hash import hash_file
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for x in entries:
+            if not isinstance(x, str):
+                x = (x, executor.submit(hash_, x))
+            pending.append(x)
+            if len(pending) > window:
+                yield resolve(pending.popleft())
+        while pending:
+            yield resolve(pending.popleft())
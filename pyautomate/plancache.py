@@ -0,0 +1,107 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Persistent cache of planned paths
+
+A path only depends on the states config, the start and end state, whether
+the end state must be matched exactly, the weights and the search, so it's
+reused when all of those are the same as in an earlier run. The least
+recently used paths are dropped when there are too many.
+'''
+
+import hashlib
+import json
+import os.path
+
+# Number of most recently used paths to keep
+_MAX_PLANS = 128
+
+class PlanCache(object):
+
+    def __init__(self, file_name):
+        self._file_name = file_name
+        self._path = None
+        self._contents = None
+        self._changed = False
+
+    @property
+    def _plans(self):
+        '''{key : [[from, symbol, to]] or None if unreachable}
+
+        ordered from least to most recently used'''
+        if self._contents is None:
+            self._path = os.path.abspath(self._file_name)
+            try:
+                with open(self._path, 'r') as f:
+                    contents = json.load(f)
+                if 'plans' not in contents:
+                    raise ValueError('Unknown format')
+            except (IOError, ValueError):
+                contents = {'plans' : {}}
+            self._contents = contents
+        return self._contents['plans']
+
+    @staticmethod
+    def make_key(states, start_state, end_state, exact, weights, search, jobs):
+        '''returns key of a path
+
+        states: YAML text of the states
+        weights: {symbol : weight} of all symbols'''
+        description = json.dumps([
+            hashlib.sha256(states.encode('UTF-8')).hexdigest(),
+            sorted(start_state), sorted(end_state), exact,
+            sorted(weights.items()), search, jobs
+        ])
+        return hashlib.sha256(description.encode('UTF-8')).hexdigest()
+
+    def __contains__(self, key):
+        return key in self._plans
+
+    def get(self, key):
+        '''returns cached path of key as list of (from, symbol, to), or None if
+        the end state was unreachable'''
+        path = self._plans.pop(key)
+        self._plans[key] = path  # most recently used
+        self._changed = True
+        if path is None:
+            return None
+        return [(frozenset(from_), symbol, frozenset(to)) 
+                for from_, symbol, to in path]
+
+    def set(self, key, path):
+        '''path: list of (from, symbol, to), or None if unreachable'''
+        if path is not None:
+            path = [[sorted(from_), symbol, sorted(to)] for from_, symbol, to in path]
+        self._plans.pop(key, None)
+        self._plans[key] = path
+        self._changed = True
+
+    def save(self):
+        if not self._changed:
+            return
+        plans = self._plans
+        for key in list(plans)[:-_MAX_PLANS]:
+            del plans[key]
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self._contents, f)
+        os.replace(temporary_path, self._path)
+        self._changed = False
+
+plan_cache = PlanCache('.pyautomate.plans')
+del PlanCache
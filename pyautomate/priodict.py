@@ -53,7 +53,7 @@ Rebuilds the heap if the number of deleted items gets large, to avoid memory lea
 		dict.__setitem__(self,key,val)
 		heap = self.__heap
 		if len(heap) > 2 * len(self):
-			self.__heap = [(v,k) for k,v in self.iteritems()]
+			self.__heap = [(v,k) for k,v in self.items()]
 			self.__heap.sort()  # builtin sort probably faster than O(n)-time heapify
 		else:
 			newPair = (val,key)
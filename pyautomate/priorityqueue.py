@@ -0,0 +1,84 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Priority queue of keys, based on heapq
+'''
+
+import heapq
+import itertools
+
+_REMOVED = object()  # placeholder for the key of a stale heap entry
+
+class PriorityQueue(object):
+
+    '''
+    Maps keys to priorities, like a dict. Iterating over it removes and yields
+    the keys in order of priority; keys of equal priority are yielded in the
+    order they were (last) set.
+
+    Changing or removing a key marks its heap entry stale, stale entries are
+    skipped when they reach the front of the heap. Keys are never compared, so
+    they needn't be orderable.
+    '''
+
+    def __init__(self):
+        self._heap = []  # [priority, count, key]
+        self._entries = {}  # key -> its entry in heap
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        return self._entries[key][0]
+
+    def __setitem__(self, key, priority):
+        if key in self._entries:
+            self._entries[key][2] = _REMOVED
+        entry = [priority, next(self._counter), key]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def __delitem__(self, key):
+        self._entries.pop(key)[2] = _REMOVED
+
+    def peek(self):
+        '''returns (key, priority) with the lowest priority'''
+        heap = self._heap
+        while heap and heap[0][2] is _REMOVED:
+            heapq.heappop(heap)
+        if not heap:
+            raise IndexError('peek at empty PriorityQueue')
+        return heap[0][2], heap[0][0]
+
+    def pop(self):
+        '''removes and returns (key, priority) with the lowest priority'''
+        heap = self._heap
+        while heap:
+            priority, count, key = heapq.heappop(heap)
+            if key is not _REMOVED:
+                del self._entries[key]
+                return key, priority
+        raise IndexError('pop from empty PriorityQueue')
+
+    def __iter__(self):
+        while self._entries:
+            yield self.pop()[0]
@@ -0,0 +1,79 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Concurrent execution of the actions of a path
+
+A step of a path has to wait for the earlier steps it conflicts with: those
+writing a state it reads or writes, or reading a state it writes. Other
+steps are independent and can be executed concurrently.
+'''
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+def get_dependencies(effects):
+    '''returns for each step the set of indices of earlier steps it waits for
+
+    effects: [(read, written)] of each step'''
+    dependencies = []
+    for i, (read, written) in enumerate(effects):
+        dependencies.append({j for j, (earlier_read, earlier_written) 
+                             in enumerate(effects[:i])
+                             if earlier_written & (read | written) or 
+                             earlier_read & written})
+    return dependencies
+
+def execute(steps, dependencies, jobs):
+    '''calls each step once its dependencies returned, calling at most jobs
+    steps at once
+
+    steps: list of callables, called in order when jobs is 1
+    dependencies: see get_dependencies
+
+    When a step raises, no further steps are started and the exception is
+    reraised once running steps returned.'''
+    if jobs <= 1:
+        for step in steps:
+            step()
+        return
+
+    done = set()
+    waiting = list(range(len(steps)))
+    running = {}  # future -> index
+    error = None
+    with ThreadPoolExecutor(jobs) as executor:
+        while waiting or running:
+            if error is None:
+                for index in list(waiting):
+                    if len(running) == jobs:
+                        break
+                    if dependencies[index] <= done:
+                        waiting.remove(index)
+                        running[executor.submit(steps[index])] = index
+            elif not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                if future.exception() is None:
+                    done.add(index)
+                elif error is None:
+                    error = future.exception()
+
+    if error is not None:
+        raise error
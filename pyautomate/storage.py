@@ -0,0 +1,151 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Storage backends of the data persisted between runs
+
+A storage maps keys to values. It is read one key at a time and written in
+batches of changed and deleted keys.
+'''
+
+import os
+import yaml
+
+class YAMLStorage(object):
+
+    '''Stores everything in a single YAML file, .pyautomate
+
+    The file is read entirely when opened and atomically replaced on write.'''
+
+    def __init__(self):
+        self._path = os.path.abspath('.pyautomate')
+        try:
+            with open(self._path, 'r') as f:
+                self._data = yaml.load(f)['last_state']
+        except IOError:
+            self._data = {}
+
+    @staticmethod
+    def exists():
+        return os.path.exists('.pyautomate')
+
+    def get(self, key):
+        return self._data[key]
+
+    def keys(self):
+        return self._data.keys()
+
+    def items(self):
+        return self._data.items()
+
+    def write(self, changed, deleted):
+        '''stores changed values and removes deleted keys
+
+        changed: {key : value}
+        deleted: iterable of keys'''
+        self._data.update(changed)
+        for key in deleted:
+            self._data.pop(key, None)
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            yaml.dump({'last_state' : self._data}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self._path)
+
+    def close(self):
+        pass
+
+class SQLiteStorage(object):
+
+    '''Stores each item as a row in an sqlite database, .pyautomate.sqlite
+
+    Items are read when first accessed and only changed items are written.
+    Keys and values are stored as YAML.'''
+
+    def __init__(self):
+        import sqlite3
+        # actions may run in other threads (--jobs), PersistedDict serializes
+        # access to the storage
+        self._connection = sqlite3.connect(os.path.abspath('.pyautomate.sqlite'),
+                                           check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS last_state '
+                                 '(key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    @staticmethod
+    def exists():
+        return os.path.exists('.pyautomate.sqlite')
+
+    def get(self, key):
+        row = self._connection.execute('SELECT value FROM last_state WHERE key = ?',
+                                       (_dump(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _load(row[0])
+
+    def keys(self):
+        return {_load(key) for (key,) in
+                self._connection.execute('SELECT key FROM last_state')}
+
+    def items(self):
+        return ((_load(key), _load(value)) for key, value in
+                self._connection.execute('SELECT key, value FROM last_state'))
+
+    def write(self, changed, deleted):
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO last_state (key, value) VALUES (?, ?)',
+                ((_dump(key), _dump(value)) for key, value in changed.items()))
+            self._connection.executemany(
+                'DELETE FROM last_state WHERE key = ?',
+                ((_dump(key),) for key in deleted))
+
+    def close(self):
+        self._connection.close()
+
+def _dump(value):
+    return yaml.dump(value, Dumper=getattr(yaml, 'CDumper', yaml.Dumper))
+
+def _load(text):
+    return yaml.load(text, Loader=getattr(yaml, 'CLoader', yaml.Loader))
+
+storages = {
+    'yaml' : YAMLStorage,
+    'sqlite' : SQLiteStorage,
+}
+
+def open_storage(name=None):
+    '''returns opened storage by name
+
+    name: one of storages. By default sqlite is used if its database exists,
+    yaml otherwise.
+
+    When opening a storage other than yaml for the first time, the contents
+    of an existing .pyautomate are migrated to it and .pyautomate is renamed
+    to .pyautomate.migrated.'''
+    if name is None:
+        name = 'sqlite' if SQLiteStorage.exists() else 'yaml'
+    storage_type = storages[name]
+    if storage_type is YAMLStorage or storage_type.exists() or \
+            not YAMLStorage.exists():
+        return storage_type()
+
+    storage = storage_type()
+    storage.write(dict(YAMLStorage().items()), ())
+    os.replace('.pyautomate', '.pyautomate.migrated')
+    return storage
@@ -16,34 +16,144 @@
 # along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from pyautomate.application import application
 
 class Trackers(object):
 
+    '''Trackers by name
+
+    The value of a tracker is computed at most once between invalidations,
+    pyautomate invalidates all trackers before and after each action.'''
+
     def __init__(self):
         self._trackers = {}
 
+        # number of times a value getter was called
+        self.getter_calls = 0
+
+        # number of times a memoized value was used instead
+        self.getter_calls_avoided = 0
+
+        # number of actions running, more than one with --jobs
+        self._running_actions = 0
+
+        self._lock = threading.Lock()
+
     def __setitem__(self, key, value_getter):
-        self._trackers[key] = _Tracker(key, value_getter)
+        self._trackers[key] = _Tracker(key, value_getter, self)
 
     def __getitem__(self, key):
         return self._trackers[key]
 
+    def have_changed(self, *keys, workers=None):
+        '''returns {key : has_changed} of trackers, evaluated concurrently
+
+        keys: names of the trackers (default: all trackers)
+        workers: maximum number of trackers evaluated at once (default: number
+        of CPUs)
+
+        Trackers hashing the same files or directories at the same time share
+        the work.'''
+        keys = list(dict.fromkeys(keys or self._trackers))
+        trackers = [self._trackers[key] for key in keys]
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(trackers))
+        if workers <= 1:
+            return {key : tracker.has_changed for key, tracker in zip(keys, trackers)}
+
+        with ThreadPoolExecutor(workers) as executor:
+            changed = executor.map(lambda tracker: tracker.has_changed, trackers)
+            return dict(zip(keys, changed))
+
+    def invalidate(self):
+        '''forgets the values of all trackers
+
+        Call this from an action when it changes tracked files after reading a
+        tracker.'''
+        for tracker in self._trackers.values():
+            tracker.invalidate()
+
+    def action_started(self):
+        '''forgets the values of all trackers, as the action may change the
+        tracked files'''
+        with self._lock:
+            self._running_actions += 1
+        self.invalidate()
+
+    def action_finished(self):
+        '''forgets the values of all trackers, as the action may have changed
+        the tracked files'''
+        with self._lock:
+            self._running_actions -= 1
+        self.invalidate()
+
+_UNKNOWN = object()
+
 class _Tracker(object): 
-    def __init__(self, key, value_getter):
+    def __init__(self, key, value_getter, trackers):
         self.__key = key
         self._get_value = value_getter
+        self._trackers = trackers
+        self._value = _UNKNOWN
+
+        # whether other actions were running when the value was computed,
+        # they may have changed the tracked files since
+        self._concurrent = False
+
+        self._lock = threading.Lock()
 
     @property
     def _key(self):
         return '#tracker: ' + self.__key
 
+    @property
+    def _current_value(self):
+        with self._lock:
+            computed = self._value is _UNKNOWN
+            if computed:
+                self._value = self._get_value()
+                self._concurrent = self._trackers._running_actions > 1
+            value = self._value
+        with self._trackers._lock:
+            if computed:
+                self._trackers.getter_calls += 1
+            else:
+                self._trackers.getter_calls_avoided += 1
+        return value
+
+    def invalidate(self):
+        self._value = _UNKNOWN
+
     def save(self):
-        application.persisted_data[self._key] = self._get_value()
+        '''persists the current value
+
+        The value read earlier in get_initial_state or in the same action is
+        saved without calling the getter again. An action that changes the
+        tracked files after reading the tracker must call
+        trackers.invalidate() before saving. The value is only recomputed when
+        other actions were running when it was read.'''
+        with self._lock:
+            if self._concurrent:
+                self._value = _UNKNOWN
+        application.persisted_data[self._key] = self._current_value
 
     @property
     def has_changed(self):
-        return has_changed(self._key, self._get_value()) 
+        return has_changed(self._key, self._current_value) 
+
+    @property
+    def changed_subtrees(self):
+        '''returns paths that changed since last save, or None if unknown
+
+        Requires the tracked value to be a tree digest, i.e. hash_(..., tree=True)'''
+        from pyautomate.treehash import changed_subtrees
+        return changed_subtrees(application.persisted_data.get(self._key),
+                                self._current_value)
 
 trackers = Trackers()
 del Trackers
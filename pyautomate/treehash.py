@@ -0,0 +1,232 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+# 
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Merkle tree digests of files and directories
+
+Each directory's digest is derived from the lines describing its direct
+children, a subdirectory is described by its digest. The nodes are persisted
+by digest, so the tree of a previously computed digest can be compared to the
+current one to find out which subtrees changed.
+'''
+
+import json
+import os.path
+import threading
+from collections import defaultdict
+
+from pyautomate.watcher import watcher
+
+# Number of most recently computed root digests whose trees are kept
+_MAX_ROOTS = 64
+
+class TreeStore(object):
+
+    '''Persistent content-addressed store of tree nodes'''
+
+    def __init__(self, file_name):
+        self._file_name = file_name
+        self._path = None
+        self._contents = None
+        self._changed = False
+        self._lock = threading.RLock()
+
+    @property
+    def _store(self):
+        '''{'nodes' : {digest : [line]}, 'roots' : [digest]}
+
+        roots are ordered from most to least recently computed'''
+        if self._contents is None:
+            with self._lock:
+                if self._contents is None:
+                    self._path = os.path.abspath(self._file_name)
+                    try:
+                        with open(self._path, 'r') as f:
+                            contents = json.load(f)
+                    except (IOError, ValueError):
+                        contents = {'nodes' : {}, 'roots' : []}
+                    self._contents = contents
+        return self._contents
+
+    def get(self, digest):
+        '''returns lines of node, or None if unknown'''
+        return self._store['nodes'].get(digest)
+
+    def add(self, digest, lines):
+        nodes = self._store['nodes']
+        if digest not in nodes:
+            nodes[digest] = lines
+            self._changed = True
+
+    def add_root(self, digest):
+        with self._lock:
+            self._add_root(digest)
+
+    def _add_root(self, digest):
+        roots = self._store['roots']
+        if roots[:1] != [digest]:
+            if digest in roots:
+                roots.remove(digest)
+            roots.insert(0, digest)
+            self._changed = True
+
+    def save(self):
+        if not self._changed:
+            return
+        self._prune()
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self._contents, f)
+        os.replace(temporary_path, self._path)
+        self._changed = False
+
+    def _prune(self):
+        '''drops nodes not reachable from the most recent roots'''
+        store = self._store
+        del store['roots'][_MAX_ROOTS:]
+        reachable = {}
+        pending = list(store['roots'])
+        while pending:
+            digest = pending.pop()
+            if digest in reachable or digest not in store['nodes']:
+                continue
+            lines = store['nodes'][digest]
+            reachable[digest] = lines
+            pending.extend(_qualified(digest, line.split(' ', 2)[1])
+                           for line in lines if line.startswith('D '))
+        store['nodes'] = reachable
+
+tree_store = TreeStore('.pyautomate.trees')
+del TreeStore
+
+def hash_tree(paths, alg_name, workers=1):
+    '''returns Merkle digest of the given existing files and directories
+
+    The digest is that of a root node listing each path by its given name and
+    is formatted as <alg_name>-tree=<hex digest>.'''
+    from pyautomate.hash import hash_file
+
+    lines = []
+    for path in paths:
+        digest = watcher.get(os.path.realpath(path), ('tree', alg_name), tree=True)
+        if digest is not None:  # an unchanged directory
+            lines.append('D %s %s' % (digest, path))
+        elif os.path.isdir(path):
+            lines.append('D %s %s' % (_hash_directory(path, alg_name, workers), path))
+        else:
+            info = os.stat(path)
+            kind = 'X' if info.st_mode & 0o111 else 'F'
+            lines.append('%s %s %s %s' % (kind, hash_file(path, alg_name, info),
+                                          info.st_size, path))
+    digest = alg_name + '-tree=' + _add_node(lines, alg_name)
+    tree_store.add_root(digest)
+    return digest
+
+def _hash_directory(root, alg_name, workers):
+    directory = os.path.realpath(root)
+    token = watcher.watch(directory)
+    digest = _hash_manifest(root, alg_name, workers)
+    watcher.set(directory, ('tree', alg_name), digest, token, tree=True)
+    return digest
+
+def _hash_manifest(root, alg_name, workers):
+    from pyautomate.manifest import generate_manifest
+
+    # manifest lists a directory's files right after its D line, directories
+    # come in pre-order
+    files = {'/' : []}
+    order = ['/']
+    current = files['/']
+    for line in generate_manifest(root, alg_name, workers):
+        if line.startswith('D '):
+            subdir = line[2:]
+            current = files[subdir] = []
+            order.append(subdir)
+        else:
+            current.append(line)
+
+    # children before parents
+    dirs = defaultdict(list)
+    for subdir in reversed(order):
+        digest = _add_node(files[subdir] + dirs[subdir][::-1], alg_name)
+        if subdir == '/':
+            return digest
+        parent, name = subdir.rsplit('/', 1)
+        dirs[parent or '/'].append('D %s %s' % (digest, name))
+
+def _add_node(lines, alg_name):
+    from pyautomate.hash import get_alg
+    digest = get_alg(alg_name)(''.join(line + '\n' for line in lines)
+                               .encode('UTF-8')).hexdigest()
+    tree_store.add(alg_name + '-tree=' + digest, lines)
+    return digest
+
+def _qualified(value, digest):
+    '''returns store key of digest, given any qualified digest of the same
+    algorithm'''
+    return value.split('=', 1)[0] + '=' + digest
+
+def changed_subtrees(old, new):
+    '''returns sorted paths that differ between two tree digests
+
+    old, new: digests as returned by hash_(..., tree=True)
+    
+    Changed directories are descended into, added or removed ones are listed
+    as a whole. Returns None if either tree is unknown.'''
+    if old == new:
+        return []
+    if not old or not new or old.split('=', 1)[0] != new.split('=', 1)[0]:
+        return None
+
+    changed = []
+    def recurse(old, new, prefix):
+        old_lines = tree_store.get(old)
+        new_lines = tree_store.get(new)
+        if old_lines is None or new_lines is None:
+            return False
+        old_entries = _entries(old_lines)
+        new_entries = _entries(new_lines)
+        for name in sorted(old_entries.keys() | new_entries.keys()):
+            old_entry = old_entries.get(name)
+            new_entry = new_entries.get(name)
+            if old_entry == new_entry:
+                continue
+            if old_entry and new_entry and old_entry[0] == new_entry[0] == 'D':
+                if not recurse(_qualified(old, old_entry[1]),
+                               _qualified(new, new_entry[1]),
+                               prefix + name + '/'):
+                    return False
+            else:
+                changed.append(prefix + name)
+        return True
+
+    if not recurse(old, new, ''):
+        return None
+    return sorted(set(changed))
+
+def _entries(lines):
+    '''returns {name : (kind, rest)} of node lines'''
+    entries = {}
+    for line in lines:
+        if line.startswith('D '):
+            kind, digest, name = line.split(' ', 2)
+            entries[name] = (kind, digest)
+        else:
+            kind, digest, size, name = line.split(' ', 3)
+            entries[name] = (kind, digest, size)
+    return entries
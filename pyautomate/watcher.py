@@ -0,0 +1,363 @@
+# Copyright 2011 Tim Diels <limyreth@gmail.com>
+#
+# This file is part of pyautomate.
+#
+# pyautomate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyautomate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyautomate.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Watches hashed directories for changes, for long-lived processes
+
+Once started (auto --daemon does), the listing of each directory hash_ lists
+is remembered, along with the digests of its files, and the directory is
+watched. A directory in which something changes is dirty, its listing is
+forgotten. So hashing a tree again only lists its dirty directories and only
+rehashes the changed files in them. The digest of a whole tree is remembered
+until a directory in it changes.
+
+Directories are watched with inotify on Linux. Elsewhere, or if the
+PYAUTOMATE_WATCH environment variable is poll, they are polled: the entries of
+the watched directories are stat'ed again whenever they are hashed, which
+saves building their listings but not the stat calls.
+
+Values are stored by the real path of a directory, with symlinks resolved,
+along with its device and inode numbers when it was watched. So a value isn't
+returned for a directory that is now reached through a repointed symlink, nor
+for one that replaced the watched directory at its path, e.g. after an
+ancestor was renamed and the path recreated; neither is reported by inotify.
+
+Note that inotify doesn't report changes made through a memory mapping or by
+other hosts on a network file system.
+'''
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import threading
+import time
+
+class Watcher(object):
+
+    def __init__(self):
+        self._backend = None
+        self._lock = threading.RLock()
+
+        # number of changes processed so far, tokens are taken from it
+        self._sequence = 0
+
+        # directory -> sequence number of its last change
+        self._changed = {}
+
+        # sequence number of the last change that made everything dirty
+        self._reset = 0
+
+        self._identities = {}  # directory -> (st_dev, st_ino) when watched
+        self._listings = {}  # directory -> {key : value}, see get
+        self._trees = {}  # directory -> {key : value}, see get
+        self._unwatched = set()  # directories that couldn't be watched
+
+    @property
+    def running(self):
+        return self._backend is not None
+
+    def start(self):
+        '''starts watching the directories that are hashed from now on'''
+        if os.environ.get('PYAUTOMATE_WATCH') == 'poll':
+            self._backend = _Poller()
+            return
+        try:
+            self._backend = _Inotify()
+        except OSError:
+            self._backend = _Poller()
+
+    def stop(self):
+        '''stops watching and forgets everything'''
+        with self._lock:
+            if self._backend is not None:
+                self._backend.close()
+                self._backend = None
+            self._changed.clear()
+            self._identities.clear()
+            self._listings.clear()
+            self._trees.clear()
+            self._unwatched.clear()
+
+    def sync(self, paths):
+        '''processes the changes made so far, call before hashing paths
+
+        paths: the files and directories about to be hashed, only directories
+        under these are polled'''
+        if self._backend is None:
+            return
+        with self._lock:
+            paths = [os.path.realpath(path) for path in paths]
+            for kind, directory in self._backend.read(paths):
+                self._sequence += 1
+                if kind == 'changed':
+                    self._changed[directory] = self._sequence
+                    self._listings.pop(directory, None)
+                    self._forget_trees(directory)
+                elif kind == 'removed':
+                    self._remove(directory)
+                else:  # lost track
+                    self._listings.clear()
+                    self._trees.clear()
+                    self._reset = self._sequence
+
+    def _remove(self, directory):
+        '''forgets directory and everything under it'''
+        self._backend.discard(directory)
+        for directories in (self._listings, self._trees, self._changed,
+                            self._identities):
+            for path in [path for path in directories
+                         if _is_under(path, directory)]:
+                del directories[path]
+        self._unwatched = {path for path in self._unwatched
+                           if not _is_under(path, directory)}
+        self._changed[directory] = self._sequence
+        self._forget_trees(directory)
+
+    def _forget_trees(self, directory):
+        '''forgets values of the trees containing directory'''
+        while True:
+            self._trees.pop(directory, None)
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return
+            directory = parent
+
+    def watch(self, directory):
+        '''watches directory, call before listing it
+
+        directory: real path, see os.path.realpath
+
+        Returns token to pass to set, or None if not running or directory is
+        missing'''
+        if self._backend is None:
+            return None
+        identity = _identity(directory)
+        if identity is None:
+            return None
+        with self._lock:
+            if self._identities.get(directory, identity) != identity:
+                # another directory replaced the watched one at this path
+                self._sequence += 1
+                self._remove(directory)
+            self._identities[directory] = identity
+            if not self._backend.add(directory):
+                self._unwatched.add(directory)
+            return (self._sequence, identity)
+
+    def get(self, directory, key, tree=False):
+        '''returns value stored for directory, or None if it's dirty
+
+        directory: real path, see os.path.realpath
+        key: what the value is of, e.g. ('manifest', alg_name)
+        tree: whether the value depends on the whole tree at directory rather
+        than only on its entries'''
+        if self._backend is None:
+            return None
+        with self._lock:
+            values = (self._trees if tree else self._listings).get(directory, {})
+            value = values.get(key)
+            identity = self._identities.get(directory)
+        if value is None or _identity(directory) != identity:
+            return None
+        return value
+
+    def set(self, directory, key, value, token, tree=False):
+        '''stores value of directory, unless it changed since watch returned
+        token
+
+        See get for the other parameters.'''
+        if token is None:
+            return
+        token, identity = token
+        with self._lock:
+            if self._backend is None or token < self._reset or \
+                    self._identities.get(directory) != identity:
+                return
+            if tree:
+                changed = any(sequence > token
+                              for path, sequence in self._changed.items()
+                              if _is_under(path, directory)) or \
+                          any(_is_under(path, directory) for path in self._unwatched)
+                values = self._trees
+            else:
+                changed = self._changed.get(directory, -1) > token or \
+                          directory in self._unwatched
+                values = self._listings
+            if not changed:
+                values.setdefault(directory, {})[key] = value
+
+watcher = Watcher()
+del Watcher
+
+def _is_under(path, directory):
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+def _identity(directory):
+    '''returns (st_dev, st_ino) of directory, or None if it's missing'''
+    try:
+        info = os.stat(directory)
+    except OSError:
+        return None
+    return (info.st_dev, info.st_ino)
+
+# inotify(7)
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_ISDIR = 0x40000000
+
+_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | \
+    _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | \
+    _IN_ONLYDIR
+
+# struct inotify_event without its name
+_EVENT = struct.Struct('iIII')
+
+class _Inotify(object):
+
+    '''Backend of Watcher using inotify
+
+    read yields (kind, directory) of each change, kind is one of changed,
+    removed and overflow'''
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify requires Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'Failed to initialize inotify')
+        self._directories = {}  # watch descriptor -> set of directories
+        self._descriptors = {}  # directory -> watch descriptor
+
+    def add(self, directory):
+        '''returns whether directory is watched'''
+        if directory not in self._descriptors:
+            descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(directory),
+                                                      _MASK)
+            if descriptor < 0:
+                return False  # e.g. out of watches
+            self._descriptors[directory] = descriptor
+            self._directories.setdefault(descriptor, set()).add(directory)
+        return True
+
+    def discard(self, directory):
+        '''stops watching directory and the directories under it'''
+        for path in [path for path in self._descriptors if _is_under(path, directory)]:
+            descriptor = self._descriptors.pop(path)
+            directories = self._directories[descriptor]
+            directories.discard(path)
+            if not directories:
+                del self._directories[descriptor]
+                self._libc.inotify_rm_watch(self._fd, descriptor)
+
+    def read(self, paths):
+        changes = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changes
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    changes.append(('overflow', None))
+                    continue
+                for directory in self._directories.get(descriptor, ()):
+                    if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED):
+                        changes.append(('removed', directory))
+                        continue
+                    changes.append(('changed', directory))
+                    if mask & _IN_ISDIR and mask & (_IN_DELETE | _IN_MOVED_FROM):
+                        changes.append(('removed', os.path.join(directory, name)))
+
+    def close(self):
+        os.close(self._fd)
+
+# Entries modified this recently may still change within the timestamp
+# granularity of the file system, see hashcache
+_RACY_NS = 2 * 10**9
+
+class _Poller(object):
+
+    '''Backend of Watcher comparing the stat signatures of directory entries'''
+
+    def __init__(self):
+        self._signatures = {}  # directory -> signature
+
+    def add(self, directory):
+        if directory not in self._signatures:
+            try:
+                self._signatures[directory] = _signature(directory)
+            except OSError:
+                return False
+        return True
+
+    def discard(self, directory):
+        for path in [path for path in self._signatures if _is_under(path, directory)]:
+            del self._signatures[path]
+
+    def read(self, paths):
+        changes = []
+        for directory, old_signature in list(self._signatures.items()):
+            if not any(_is_under(directory, path) for path in paths):
+                continue
+            try:
+                signature = _signature(directory)
+            except OSError:
+                changes.append(('removed', directory))
+                continue
+            if signature is None or signature != old_signature:
+                self._signatures[directory] = signature
+                changes.append(('changed', directory))
+        return changes
+
+    def close(self):
+        pass
+
+def _signature(directory):
+    '''returns stat signature of the entries of directory, or None if it may
+    change without the signature changing'''
+    signature = []
+    racy = time.time_ns() - _RACY_NS
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            info = entry.stat(follow_symlinks=False)
+            if info.st_mtime_ns > racy:
+                return None
+            signature.append((entry.name, info.st_mode, info.st_size,
+                              info.st_mtime_ns, info.st_ino))
+    signature.sort()
+    return signature
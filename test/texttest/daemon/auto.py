@@ -0,0 +1,175 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from pyautomate import hash_
+
+# the daemon serves served/auto.py, these actions make calls to it
+states = '''
+- transitions:
+
+      - action: forward_output()
+        to: output forwarded
+
+      - action: forward_exit_code()
+        to: exit code forwarded
+
+      - action: roll_back_failed_call()
+        to: failed call rolled back
+
+      - action: forward_verbosity()
+        to: verbosity forwarded
+
+      - action: terminate_during_call()
+        to: daemon terminated
+
+      - action: call_other_auto_file()
+        to: other auto file called
+
+      - action: watch_tree('inotify')
+        to: tree watched with inotify
+
+      - action: watch_tree('poll')
+        to: tree watched by polling
+'''
+
+def get_initial_state():
+    return ()
+
+auto = [sys.executable, os.path.abspath(sys.argv[0]), '--file', 'served/auto.py']
+
+def call(*args, **env):
+    sys.stdout.flush()
+    return subprocess.call(auto + list(args), env=dict(os.environ, **env))
+
+def start_daemon(**env):
+    daemon = subprocess.Popen(auto + ['--daemon'], env=dict(os.environ, **env))
+    for i in range(100):
+        with socket.socket(socket.AF_UNIX) as client:
+            try:
+                client.connect('served/.pyautomate.sock')
+                return daemon
+            except OSError:
+                time.sleep(0.1)
+    daemon.terminate()
+    raise Exception('daemon did not start')
+
+def stop_daemon(daemon):
+    daemon.terminate()
+    daemon.wait()
+
+def forward_output():
+    daemon = start_daemon()
+    try:
+        call('ran', MESSAGE='hello')
+    finally:
+        stop_daemon(daemon)
+
+def forward_exit_code():
+    daemon = start_daemon()
+    try:
+        print('exit code:', call('notastate'))
+    finally:
+        stop_daemon(daemon)
+
+def roll_back_failed_call():
+    daemon = start_daemon()
+    try:
+        print('exit code:', call('ran', FAIL=get_initial_state.__name__))
+        call('ran')
+    finally:
+        stop_daemon(daemon)
+
+def forward_verbosity():
+    daemon = start_daemon()
+    try:
+        call('-v', '1', 'ran')
+        call('-v', '3', '--exact', 'ran')  # not the plan of the first call
+    finally:
+        stop_daemon(daemon)
+
+def terminate_during_call():
+    daemon = start_daemon()
+    try:
+        sys.stdout.flush()
+        client = subprocess.Popen(auto + ['waited'])
+        while not os.path.exists('served/waiting'):
+            time.sleep(0.1)
+        daemon.terminate()
+        print('exit code:', client.wait())
+        print('daemon exit code:', daemon.wait(10))
+        print('socket removed:', not os.path.exists('served/.pyautomate.sock'))
+    finally:
+        stop_daemon(daemon)
+
+def call_other_auto_file():
+    daemon = start_daemon()
+    try:
+        for args in (['-f', 'served/other.py'], ['-ef', 'served/other.py'],
+                     ['--fi=served/other.py', '-v1']):
+            sys.stdout.flush()
+            print('exit code:', subprocess.call(auto[:2] + args + ['ran']))
+    finally:
+        stop_daemon(daemon)
+
+def write(path, contents):
+    with open(path, 'w') as f:
+        f.write(contents)
+
+def age(directory):
+    '''moves the modification times under directory to the past, the poller
+    ignores the signatures of recently modified directories'''
+    for parent, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            os.utime(os.path.join(parent, name), (0, 0))
+
+def check(change):
+    print(change + ':')
+    # the daemon runs calls in served, tree digests include the given path
+    os.chdir('served')
+    try:
+        digests = dict(DIGEST=hash_('../current/tree'),
+                       TREE_DIGEST=hash_('../current/tree', tree=True))
+    finally:
+        os.chdir('..')
+    call('hashed', **digests)
+
+def watch_tree(backend):
+    os.makedirs('a/tree/sub')
+    write('a/tree/file', 'file')
+    write('a/tree/sub/file', 'file')
+    os.symlink('a', 'current')
+    age('a')
+    daemon = start_daemon(PYAUTOMATE_WATCH=backend)
+    try:
+        check('hashed')
+        check('unchanged')
+
+        write('a/tree/sub/file', 'modified')
+        age('a')
+        check('modified')
+
+        write('a/tree/sub/new', 'new')
+        age('a')
+        check('created')
+
+        os.rename('a/tree/sub', 'a/tree/moved')
+        age('a')
+        check('directory moved')
+
+        shutil.copytree('a', 'b')
+        write('b/tree/moved/file', 'repointed')
+        age('b')
+        os.symlink('b', 'next')
+        os.replace('next', 'current')
+        check('symlink repointed')
+
+        os.rename('b', 'old')
+        shutil.copytree('old', 'b')
+        write('b/tree/moved/file', 'recreated')
+        age('b')
+        check('ancestor renamed and path recreated')
+    finally:
+        stop_daemon(daemon)
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import time
+from pyautomate import persisted, hash_
+
+states = '''
+- transitions:
+
+      - action: run()
+        to: ran
+
+      - action: hash_tree()
+        to: hashed
+
+      - action: wait()
+        to: waited
+'''
+
+def get_initial_state():
+    if os.environ.get('FAIL') == 'get_initial_state':
+        persisted['uncommitted'] = 'leaked'
+        sys.exit(1)
+    return ()
+
+def run():
+    print('served by the daemon:', '--daemon' in sys.argv)
+    print('MESSAGE:', os.environ.get('MESSAGE'))
+    sys.stdout.flush()
+    subprocess.check_call([sys.executable, '-c', 'print("printed by a subprocess")'])
+    print('uncommitted:', persisted.get('uncommitted'))
+
+def wait():
+    open('waiting', 'w').close()
+    time.sleep(60)
+
+def hash_tree():
+    from pyautomate.watcher import watcher
+    path = '../current/tree'
+    watcher.sync([path])
+    print('cached:', watcher.get(os.path.realpath(path), ('directory', 'sha256'),
+                                 tree=True) is not None)
+    print('digest up to date:', hash_(path) == os.environ['DIGEST'])
+    print('tree digest up to date:',
+          hash_(path, tree=True) == os.environ['TREE_DIGEST'])
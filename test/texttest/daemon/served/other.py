@@ -0,0 +1,15 @@
+import sys
+
+# another auto file next to the one the daemon serves
+states = '''
+- transitions:
+
+      - action: run()
+        to: ran
+'''
+
+def get_initial_state():
+    return ()
+
+def run():
+    print('served by the daemon:', '--daemon' in sys.argv)
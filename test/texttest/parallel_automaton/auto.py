@@ -0,0 +1,36 @@
+from pyautomate import persisted
+
+states = '''
+- transitions:
+
+      - action: build_all()
+        to:
+            - server built
+            - client built
+
+      - action: build_server()
+        to: server built
+
+      - action: build_client()
+        to: client built
+'''
+
+def get_initial_state():
+    return ()
+
+def build_all():
+    persisted['built by'] = 'build_all'
+
+def build_server():
+    persisted['server built by'] = 'build_server'
+
+def build_client():
+    persisted['client built by'] = 'build_client'
+
+# building both at once takes less work, but building them separately finishes
+# sooner when they run at the same time
+weights = {
+    'build_all()': 3000,
+    'build_server()': 2000,
+    'build_client()': 2000,
+}
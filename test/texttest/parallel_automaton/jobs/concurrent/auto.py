@@ -0,0 +1,27 @@
+from pyautomate import persisted
+import threading
+
+states = '''
+- transitions:
+
+      - action: build_server()
+        to: server built
+
+      - action: build_client()
+        to: client built
+'''
+
+def get_initial_state():
+    return ()
+
+# each action waits for the other to start, which they only do when executed
+# at the same time
+started = threading.Barrier(2, timeout=10)
+
+def build_server():
+    started.wait()
+    persisted['server built by'] = 'build_server'
+
+def build_client():
+    started.wait()
+    persisted['client built by'] = 'build_client'
@@ -0,0 +1,9 @@
+from pyautomate import trackers, quick_hash_
+
+states = ''
+
+def get_initial_state():
+    trackers['last compiled'] = lambda: quick_hash_('file.f', verify=True)
+    print(trackers['last compiled'].has_changed)
+    return 'state'
+
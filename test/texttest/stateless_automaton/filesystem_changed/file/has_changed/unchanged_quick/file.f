@@ -0,0 +1 @@
+unchanged
@@ -0,0 +1,9 @@
+from pyautomate import trackers, hash_
+
+states = ''
+
+def get_initial_state():
+    trackers['last compiled'] = lambda: hash_('file.f', alg_name='blake2b-128')
+    trackers['last compiled'].save()
+    return 'state'
+
@@ -0,0 +1,10 @@
+from pyautomate import persisted
+
+states = '''
+'''
+
+def get_initial_state():
+    print(sorted(persisted.items()))
+    persisted['key'] = 'value'
+    return 'state'
+
@@ -0,0 +1,71 @@
+import threading
+from pyautomate import trackers
+
+# number of times the value of the tracker was computed
+calls = 0
+
+def read_tracked():
+    global calls
+    calls += 1
+    with open('tracked') as f:
+        return f.read()
+
+trackers['tracked'] = read_tracked
+
+states = '''
+- transitions:
+
+      - action: read_and_save()
+        to: read and saved
+
+      - action: change_and_save()
+        to: changed and saved
+
+      - action: read_and_save_concurrently()
+        to: read and saved concurrently
+
+      - action: change_concurrently()
+        to: changed concurrently
+'''
+
+def get_initial_state():
+    write('initial')
+    trackers['tracked'].has_changed
+    trackers['tracked'].save()
+    print('getter calls in get_initial_state:', calls)
+    return ()
+
+def write(contents):
+    with open('tracked', 'w') as f:
+        f.write(contents)
+
+def read_and_save():
+    trackers['tracked'].has_changed
+    trackers['tracked'].save()
+    print('getter calls:', calls)
+
+def change_and_save():
+    trackers['tracked'].has_changed
+    write('changed')
+    trackers.invalidate()
+    trackers['tracked'].save()
+    print('getter calls:', calls)
+
+# lets the actions run with --jobs 2 take turns
+_barrier = threading.Barrier(2, timeout=10)
+
+def read_and_save_concurrently():
+    _barrier.wait()
+    trackers['tracked'].has_changed
+    _barrier.wait()
+    _barrier.wait()
+    trackers['tracked'].save()
+    print('getter calls:', calls)
+    _barrier.wait()
+
+def change_concurrently():
+    _barrier.wait()
+    _barrier.wait()
+    write('changed concurrently')
+    _barrier.wait()
+    _barrier.wait()